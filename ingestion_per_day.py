@@ -1,12 +1,61 @@
+import argparse
+import asyncio
+import bisect
+import csv
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 from datetime import datetime, timezone, timedelta
 import getpass
+import heapq
+import json
+import math
+import os
+import random
+import re
+import sqlite3
+import sys
+import threading
+import time
+from array import array
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import compress
+from urllib.parse import urlsplit
 
 # ================= CONFIG =================
+# Parallel requests (start value with adaptive concurrency); --workers overrides
+# it and, with adaptive concurrency, also becomes the ceiling
 MAX_WORKERS = 5
 
+# Adaptive concurrency (AIMD): the number of in-flight requests starts at
+# MAX_WORKERS (or the free search threads reported by _nodes/stats), grows by
+# one while p95 latency stays within ADAPTIVE_LATENCY_TOLERANCE of its best
+# value, and is halved on HTTP 429/503, es_rejected_execution_exception or a timeout
+ADAPTIVE_CONCURRENCY = True
+ADAPTIVE_MIN_WORKERS = 1
+ADAPTIVE_MAX_WORKERS = 32
+ADAPTIVE_WINDOW = 20
+ADAPTIVE_LATENCY_TOLERANCE = 1.5
+ADAPTIVE_SEED_FROM_NODES = True
+
+# How range counts are issued: "msearch" batches them through _msearch,
+# "terms" runs one terms-on-_index aggregation per timestamp field,
+# "per_index" sends one _count per index/data stream
+COUNT_MODE = "msearch"
+MSEARCH_BATCH_SIZE = 200
+
+# Timestamp field candidates, in priority order
+TIMESTAMP_CANDIDATES = ("@timestamp", "timestamp", "event.created", "time", "date")
+
+# How timestamp fields are detected: "field_caps" resolves all regular indices
+# with one _field_caps call, "mapping" downloads each index mapping
+TIMESTAMP_DETECTION = "field_caps"
+
+# Terms aggregation mode: max length of the comma-joined index list per URL
+# (ES rejects request lines over 4kb by default) and max buckets per search
+TERMS_MAX_URL_CHARS = 3000
+TERMS_AGG_MAX_BUCKETS = 65536
+
 # Prefixes to always exclude (restored copies, system indices)
 EXCLUDE_PREFIXES = (
     ".",
@@ -16,242 +65,3949 @@ EXCLUDE_PREFIXES = (
     "shrink-",
 )
 
+# Send EXCLUDE_PREFIXES as negated wildcards (-prefix*) with
+# expand_wildcards=open in the _cat/indices request, so excluded and closed
+# indices are dropped server-side instead of downloaded and filtered here
+CAT_SERVER_SIDE_EXCLUDE = True
+
+# How data streams and regular indices are discovered: "cat" calls
+# _data_stream and _cat/indices, "resolve" gets both from one
+# _resolve/index request, with the index filter applied to data streams too
+DISCOVERY = "cat"
+
+# Retries: transient failures (statuses below, connection errors, timeouts) are
+# retried with full-jitter exponential backoff, capped by a per-run budget per
+# cluster. BREAKER_THRESHOLD consecutive overload responses pause requests to
+# that cluster for BREAKER_PAUSE seconds so it can recover from shedding load.
+RETRY_STATUSES = (429, 502, 503, 504)
+RETRY_MAX_ATTEMPTS = 4
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 20.0
+RETRY_BUDGET = 500
+BREAKER_THRESHOLD = 5
+BREAKER_PAUSE = 30.0
+
+# On-disk cache of per-index counts, keyed by index UUID, window and timestamp
+# field. Entries are reused for read-only indices, rolled-over backing indices
+# and indices whose doc count is unchanged and newest doc predates the cached run.
+STATS_CACHE = True
+STATS_CACHE_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "es-ingest-analyzer", "stats.sqlite3"
+)
+
+# Data streams: only count backing indices whose time bounds overlap the
+# window (TSDS start/end time, otherwise min/max @timestamp, cached on disk
+# for rolled-over generations) and weight avg doc size by those indices only
+DS_PRUNE_GENERATIONS = True
+
+# Indices whose min and max timestamp both fall inside the window are not
+# range-counted: their count is the number of docs carrying the timestamp
+# field, taken from the bounds search (and cached with the bounds). TSDS
+# generations and bounds cached without that number are range-counted as
+# before. Only indices straddling a window edge are counted.
+SKIP_CONTAINED_COUNTS = True
+
+# Incremental mode: per-target, per-day doc counts and byte estimates are kept
+# in a local ledger; each run only counts the days not yet closed (plus today).
+# A day is closed LEDGER_CLOSE_AFTER_HOURS after it ends, to absorb late data.
+INCREMENTAL_LEDGER = False
+LEDGER_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "es-ingest-analyzer", "ledger.sqlite3"
+)
+LEDGER_CLOSE_AFTER_HOURS = 2
+
+# Timestamp detection memoized per index template: regular indices created
+# from a template whose mappings (with its component templates) define a
+# date-typed timestamp candidate take that field without an index lookup.
+# Results are kept on disk per cluster and template, and recomputed when the
+# template or one of its component templates changes version
+TEMPLATE_TS_CACHE = True
+TEMPLATE_CACHE_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "es-ingest-analyzer", "templates.sqlite3"
+)
+
+# Daily time series: replace each range count with a calendar-day
+# date_histogram (days in DAILY_TIME_ZONE) so the report shows the min, mean,
+# p95 and peak day next to the window average
+DAILY_SERIES = False
+DAILY_TIME_ZONE = "UTC"
+
+# --peak-hour: hourly buckets per target, searched PEAK_HOUR_BATCH_SIZE per
+# _msearch request; hourly percentiles come from a log-bucketed sketch with
+# this relative accuracy and at most PEAK_HOUR_SKETCH_BINS bins
+PEAK_HOUR_BATCH_SIZE = 20
+PEAK_HOUR_SKETCH_ACCURACY = 0.01
+PEAK_HOUR_SKETCH_BINS = 2048
+
+# Sampled doc size: after the analysis, a random sample of each target's
+# window documents is measured (serialized _source length, or the _size field
+# of the mapper-size plugin through a random_sampler aggregation) and the
+# estimated window size is reported with a 95% confidence interval.
+# DOC_SIZE_SAMPLE_PROBABILITY trades cost for accuracy; source sampling
+# fetches that share of window docs, clamped to MIN..MAX documents.
+DOC_SIZE_SAMPLING = False
+DOC_SIZE_FIELD = None
+DOC_SIZE_SAMPLE_PROBABILITY = 0.001
+DOC_SIZE_SAMPLE_MIN = 30
+DOC_SIZE_SAMPLE_MAX = 1000
+DOC_SIZE_SAMPLE_SEED = 42
+DOC_SIZE_SAMPLE_BATCH_SIZE = 10
+
+# --engine async: max concurrent requests on the event loop
+ASYNC_MAX_IN_FLIGHT = 200
+
+# --clusters: in-flight request caps for a multi-cluster run, fleet-wide and
+# per cluster (a cluster definition may set its own max_in_flight)
+FLEET_MAX_IN_FLIGHT = 64
+FLEET_CLUSTER_MAX_IN_FLIGHT = 16
+
+# --parquet: rows buffered per record batch / row group
+SINK_BATCH_SIZE = 1000
+
+# Print bytes on the wire per phase at the end of the run
+DEBUG_WIRE_STATS = False
+
+# Environment variable holding the password unless --password-env/--password-file say otherwise
+PASSWORD_ENV = "ES_PASSWORD"
+
+# Process exit codes (argparse exits with 2 on usage errors)
+EXIT_OK = 0
+EXIT_ERROR = 1      # invalid input, or nothing could be analyzed
+EXIT_PARTIAL = 3    # report written, but some targets or clusters failed
+
 # ================= UTIL =================
 def format_size(value_gb):
     if value_gb >= 1:
         return f"{value_gb:.2f} GB"
     return f"{value_gb * 1024:.2f} MB"
 
+def format_bytes(value):
+    for unit in ("B", "KB", "MB"):
+        if value < 1024:
+            return f"{value:.0f} {unit}" if unit == "B" else f"{value:.1f} {unit}"
+        value /= 1024
+    return f"{value:.2f} GB"
+
 def print_section(title):
     print(f"\n{'='*60}")
     print(f"  {title}")
     print(f"{'='*60}")
 
-# ================= ELASTIC: DATA STREAM =================
-def get_data_streams(es_url, auth):
-    """Retrieve all existing data streams."""
-    r = requests.get(f"{es_url}/_data_stream", auth=auth, verify=False, timeout=30)
+# ================= HTTP CLIENT =================
+def worker_count():
+    """Number of worker threads: the adaptive ceiling, or the fixed MAX_WORKERS."""
+    return ADAPTIVE_MAX_WORKERS if ADAPTIVE_CONCURRENCY else MAX_WORKERS
+
+def set_max_workers(n):
+    """
+    Apply --workers: the fixed pool size, or the adaptive start value and
+    ceiling. Seeding from the nodes' idle search threads is skipped so the
+    limit the user gave is never exceeded.
+    """
+    global MAX_WORKERS, ADAPTIVE_MAX_WORKERS, ADAPTIVE_SEED_FROM_NODES
+    MAX_WORKERS = n
+    ADAPTIVE_MAX_WORKERS = n
+    ADAPTIVE_SEED_FROM_NODES = False
+
+class AdaptiveConcurrency:
+    """
+    AIMD limit on the number of in-flight Elasticsearch requests.
+    Worker threads call acquire() before and release() after each request.
+    Every `window` successful requests the p95 latency is compared with the
+    best p95 seen so far: if it stayed flat the limit grows by one. An
+    overload signal halves the limit, at most once per window.
+    """
+
+    def __init__(self, initial, minimum, maximum, window, tolerance):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.window = window
+        self.tolerance = tolerance
+        self.limit = max(minimum, min(initial, maximum))
+        self.peak = self.limit
+        self.increases = 0
+        self.decreases = 0
+        self._in_flight = 0
+        self._latencies = []
+        self._best_p95 = None
+        self._cut_this_window = False
+        self._cond = threading.Condition()
+
+    def seed(self, initial):
+        """Reset the starting limit, e.g. from the cluster's free search threads."""
+        with self._cond:
+            self.limit = max(self.minimum, min(initial, self.maximum))
+            self.peak = max(self.peak, self.limit)
+            self._cond.notify_all()
+
+    def acquire(self):
+        with self._cond:
+            while self._in_flight >= self.limit:
+                self._cond.wait()
+            self._in_flight += 1
+
+    def release(self, latency, overloaded=False):
+        """Free a slot; a latency of None (a failed request) adds no sample."""
+        with self._cond:
+            self._in_flight -= 1
+
+            if overloaded:
+                if not self._cut_this_window:
+                    self.limit = max(self.minimum, self.limit // 2)
+                    self.decreases += 1
+                    self._cut_this_window = True
+                self._latencies = []
+            elif latency is not None:
+                self._latencies.append(latency)
+
+            if len(self._latencies) >= self.window:
+                ordered = sorted(self._latencies)
+                p95 = ordered[int(0.95 * (len(ordered) - 1))]
+                if self._best_p95 is None or p95 < self._best_p95:
+                    self._best_p95 = p95
+                if p95 <= self._best_p95 * self.tolerance and self.limit < self.maximum:
+                    self.limit += 1
+                    self.increases += 1
+                    self.peak = max(self.peak, self.limit)
+                self._latencies = []
+                self._cut_this_window = False
+
+            self._cond.notify_all()
+
+class RetryPolicy:
+    """
+    Retry state of one cluster for a run: jittered exponential backoff, a
+    budget of retries across its requests, and a circuit breaker that opens
+    after `breaker_threshold` consecutive overload responses.
+    Both engines use it; the sync adapter sleeps, the async engine awaits.
+    """
+
+    def __init__(self, max_attempts, base_delay, max_delay, budget,
+                 breaker_threshold, breaker_pause):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.breaker_threshold = breaker_threshold
+        self.breaker_pause = breaker_pause
+        self.retries_used = 0
+        self.breaker_trips = 0
+        self._consecutive_overloads = 0
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def backoff(self, attempt, retry_after=None):
+        """Seconds to wait before the given retry attempt (1-based)."""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        try:
+            delay = max(delay, min(float(retry_after), self.max_delay))
+        except (TypeError, ValueError):
+            pass
+        return delay
+
+    def take_retry(self):
+        """Consume one retry from the run budget; False once it is exhausted."""
+        with self._lock:
+            if self.retries_used >= self.budget:
+                return False
+            self.retries_used += 1
+            return True
+
+    def record(self, overloaded):
+        """Track consecutive overload responses and open the breaker when needed."""
+        with self._lock:
+            if not overloaded:
+                self._consecutive_overloads = 0
+                return
+            self._consecutive_overloads += 1
+            if self._consecutive_overloads >= self.breaker_threshold:
+                self._consecutive_overloads = 0
+                self._paused_until = time.monotonic() + self.breaker_pause
+                self.breaker_trips += 1
+
+    def pause_remaining(self):
+        """Seconds left while the circuit breaker is open, 0 when closed."""
+        with self._lock:
+            return max(0.0, self._paused_until - time.monotonic())
+
+_retry_policies = {}
+_retry_policies_lock = threading.Lock()
+
+def get_retry_policy(es_url):
+    """
+    Return the RetryPolicy of the cluster at `es_url` (any URL on it),
+    creating it on first use. An overloaded cluster only trips its own
+    breaker and spends its own retry budget.
+    """
+    origin = url_origin(es_url)
+    with _retry_policies_lock:
+        policy = _retry_policies.get(origin)
+        if policy is None:
+            policy = RetryPolicy(
+                RETRY_MAX_ATTEMPTS,
+                RETRY_BASE_DELAY,
+                RETRY_MAX_DELAY,
+                RETRY_BUDGET,
+                BREAKER_THRESHOLD,
+                BREAKER_PAUSE,
+            )
+            _retry_policies[origin] = policy
+    return policy
+
+def is_overloaded(status_code, content):
+    """True if a response means the cluster is shedding load."""
+    return status_code in (429, 503) or b"es_rejected_execution_exception" in content
+
+class RequestBudget:
+    """
+    Caps in-flight requests for a multi-cluster run: one fleet-wide limit
+    and one limit per cluster, matched on the request URL's origin.
+    The cluster slot is taken before the fleet slot, so requests queued
+    behind a busy cluster never hold fleet capacity. Slots are held for a
+    single attempt, never across a retry backoff. Worker threads block in
+    acquire(); the async engine awaits acquire_async() on its own loop.
+    """
+
+    def __init__(self, fleet_limit):
+        self._fleet = threading.BoundedSemaphore(fleet_limit)
+        self._clusters = {}
+        self._waiters = set()
+        self._waiters_lock = threading.Lock()
+
+    def add_cluster(self, es_url, limit):
+        self._clusters[url_origin(es_url)] = threading.BoundedSemaphore(limit)
+
+    def _slots(self, url):
+        """Semaphores of a request, most specific first."""
+        cluster = self._clusters.get(url_origin(url))
+        return [cluster, self._fleet] if cluster is not None else [self._fleet]
+
+    def acquire(self, url):
+        """Take the cluster's slot, then a fleet slot; returns what must be released."""
+        held = self._slots(url)
+        for semaphore in held:
+            semaphore.acquire()
+        return held
+
+    def try_acquire(self, url):
+        """Take all slots of a request without blocking; None if one is busy."""
+        held = []
+        for semaphore in self._slots(url):
+            if not semaphore.acquire(blocking=False):
+                self.release(held)
+                return None
+            held.append(semaphore)
+        return held
+
+    async def acquire_async(self, url):
+        """Wait on the running event loop until all slots of a request are free."""
+        loop = asyncio.get_running_loop()
+        while True:
+            held = self.try_acquire(url)
+            if held is not None:
+                return held
+            waiter = (loop, asyncio.Event())
+            with self._waiters_lock:
+                self._waiters.add(waiter)
+            try:
+                # Re-check after registering so a release in between is not missed
+                held = self.try_acquire(url)
+                if held is not None:
+                    return held
+                await waiter[1].wait()
+            finally:
+                with self._waiters_lock:
+                    self._waiters.discard(waiter)
+
+    def release(self, held):
+        for semaphore in reversed(held):
+            semaphore.release()
+        if held:
+            with self._waiters_lock:
+                waiters = list(self._waiters)
+            for loop, event in waiters:
+                loop.call_soon_threadsafe(event.set)
+
+_request_budget = None
+
+def set_request_budget(budget):
+    """Install (or with None remove) the RequestBudget every request goes through."""
+    global _request_budget
+    _request_budget = budget
+
+def url_origin(url):
+    """scheme://host:port of a URL, used to tell clusters apart."""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+class EsAdapter(HTTPAdapter):
+    """
+    HTTPAdapter for all Elasticsearch calls: waits while the target cluster's
+    circuit breaker is open, runs each attempt under an AdaptiveConcurrency
+    slot of that cluster (when adaptive) and then the RequestBudget
+    (multi-cluster runs), and retries transient failures according to the
+    cluster's RetryPolicy.
+    """
+
+    def __init__(self, adaptive=False, retry=False, **kwargs):
+        self.adaptive = adaptive
+        self.retry = retry
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        controller = get_controller(request.url) if self.adaptive else None
+        policy = get_retry_policy(request.url) if self.retry else None
+        budget = _request_budget
+        attempt = 0
+        while True:
+            pause = policy.pause_remaining() if policy else 0
+            if pause:
+                time.sleep(pause)
+
+            r, error, overloaded = None, None, False
+            # Most specific slot first: a thread waiting on its cluster's
+            # limit holds no fleet capacity
+            if controller:
+                controller.acquire()
+            held = budget.acquire(request.url) if budget else None
+            started = time.monotonic()
+            try:
+                r = super().send(request, **kwargs)
+                overloaded = is_overloaded(r.status_code, r.content)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = e
+                overloaded = isinstance(e, requests.exceptions.Timeout)
+            finally:
+                if controller:
+                    # A connection error says nothing about latency under load
+                    latency = None if error else time.monotonic() - started
+                    controller.release(latency, overloaded)
+                if held:
+                    budget.release(held)
+
+            if policy is None:
+                if error:
+                    raise error
+                return r
+
+            policy.record(overloaded)
+            attempt += 1
+            retryable = error is not None or r.status_code in RETRY_STATUSES
+            if (not retryable or attempt >= policy.max_attempts
+                    or not policy.take_retry()):
+                if error:
+                    raise error
+                return r
+
+            retry_after = r.headers.get("Retry-After") if r is not None else None
+            time.sleep(policy.backoff(attempt, retry_after))
+
+_controllers = {}
+_controllers_lock = threading.Lock()
+
+def get_controller(es_url):
+    """
+    Return the AdaptiveConcurrency controller of the cluster at `es_url`
+    (any URL on it), creating it on first use. Each cluster adapts on its own
+    latency and rejections.
+    """
+    origin = url_origin(es_url)
+    with _controllers_lock:
+        controller = _controllers.get(origin)
+        if controller is None:
+            controller = AdaptiveConcurrency(
+                MAX_WORKERS,
+                ADAPTIVE_MIN_WORKERS,
+                ADAPTIVE_MAX_WORKERS,
+                ADAPTIVE_WINDOW,
+                ADAPTIVE_LATENCY_TOLERANCE,
+            )
+            _controllers[origin] = controller
+    return controller
+
+def seed_concurrency(es_url, auth):
+    """
+    Seed the adaptive limit with the number of idle search threads in the cluster
+    (sum of threads - active over all nodes). Returns the seed, or None on failure.
+    """
+    try:
+        r = get_session(auth).get(
+            f"{es_url}/_nodes/stats/thread_pool/search",
+            params={"filter_path": "nodes.*.thread_pool.search"},
+            timeout=15,
+        )
+        r.raise_for_status()
+        pools = [
+            node["thread_pool"]["search"]
+            for node in r.json().get("nodes", {}).values()
+        ]
+    except Exception:
+        return None
+
+    idle = sum(max(p.get("threads", 0) - p.get("active", 0), 0) for p in pools)
+    if idle <= 0:
+        return None
+    get_controller(es_url).seed(idle)
+    return idle
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def get_session(auth):
+    """
+    Return the shared session for the given credentials, creating it on first use.
+    All discovery and analysis calls go through this session so keep-alive
+    connections are reused for the whole run instead of one handshake per index.
+    The connection pool is sized to worker_count() so every worker keeps a
+    connection. The EsAdapter retries transient failures and, with
+    ADAPTIVE_CONCURRENCY, gates every request through its cluster's controller.
+    """
+    key = (auth.username, auth.password) if auth else None
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            session.auth = auth
+            session.verify = False
+            session.headers["Accept-Encoding"] = "gzip"
+            session.hooks["response"].append(record_wire_bytes)
+            adapter = EsAdapter(
+                adaptive=ADAPTIVE_CONCURRENCY,
+                retry=True,
+                pool_maxsize=worker_count(),
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[key] = session
+    return session
+
+def connection_stats():
+    """
+    Summarize connection usage across all shared sessions.
+    Every new connection costs a TCP (and TLS) handshake; every other request
+    was served over a reused keep-alive connection.
+    """
+    requests_sent = 0
+    connections_opened = 0
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+
+    seen = set()
+    for session in sessions:
+        for adapter in session.adapters.values():
+            if id(adapter) in seen or not hasattr(adapter, "poolmanager"):
+                continue
+            seen.add(id(adapter))
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                requests_sent += pool.num_requests
+                connections_opened += pool.num_connections
+
+    return {
+        "requests": requests_sent,
+        "handshakes": connections_opened,
+        "reused": max(requests_sent - connections_opened, 0),
+    }
+
+# ================= ESTIMATION =================
+def range_query(ts_field, start_dt, end_dt):
+    """
+    Build the query clause that selects documents inside the analysis window.
+    Without a timestamp field every document matches.
+    """
+    if not ts_field:
+        return {"match_all": {}}
+    return {
+        "range": {
+            ts_field: {
+                "gte": start_dt.isoformat(),
+                "lte": end_dt.isoformat()
+            }
+        }
+    }
+
+def daily_histogram_body(ts_field, start_dt, end_dt, time_zone="UTC"):
+    """
+    Search body that counts the window's documents per calendar day.
+    Empty days inside the window are returned as zero buckets.
+    """
+    return {
+        "size": 0,
+        "track_total_hits": False,
+        "query": range_query(ts_field, start_dt, end_dt),
+        "aggs": {
+            "days": {
+                "date_histogram": {
+                    "field": ts_field,
+                    "calendar_interval": "day",
+                    "time_zone": time_zone,
+                    "format": "yyyy-MM-dd",
+                    "min_doc_count": 0,
+                    "extended_bounds": {
+                        "min": int(start_dt.timestamp() * 1000),
+                        "max": int(end_dt.timestamp() * 1000),
+                    },
+                }
+            }
+        },
+    }
+
+DAILY_BUCKETS_FILTER = "aggregations.days.buckets.key_as_string,aggregations.days.buckets.doc_count"
+
+def parse_daily_buckets(data):
+    """Turn a date_histogram response into {"YYYY-MM-DD": count}."""
+    # filter_path drops the aggregation entirely when it has no buckets
+    buckets = data.get("aggregations", {}).get("days", {}).get("buckets", [])
+    return {b["key_as_string"]: b["doc_count"] for b in buckets}
+
+def add_daily(total, daily):
+    """Add the per-day counts of `daily` into `total` in place."""
+    for day, count in daily.items():
+        total[day] = total.get(day, 0) + count
+    return total
+
+def post_range_count(session, es_url, index_expr, ts_field, start_dt, end_dt):
+    """
+    Count the documents of `index_expr` inside the window with one request.
+    Returns (count, daily): with DAILY_SERIES and a timestamp field the count
+    comes from a daily date_histogram and daily is {"YYYY-MM-DD": count},
+    otherwise _count is used and daily is None.
+    """
+    if DAILY_SERIES and ts_field:
+        endpoint = "_search"
+        params = {"filter_path": DAILY_BUCKETS_FILTER}
+        body = daily_histogram_body(ts_field, start_dt, end_dt, DAILY_TIME_ZONE)
+    else:
+        endpoint = "_count"
+        params = {"filter_path": "count"}
+        body = {"query": range_query(ts_field, start_dt, end_dt)}
+
+    r = session.post(f"{es_url}/{index_expr}/{endpoint}", params=params, json=body, timeout=30)
+    if r.status_code != 200:
+        raise RuntimeError(f"{endpoint} returned HTTP {r.status_code}")
+    if endpoint == "_count":
+        return r.json().get("count", 0), None
+    daily = parse_daily_buckets(r.json())
+    return sum(daily.values()), daily
+
+def contained_units(units, contained, ts_field):
+    """
+    Known range counts of the units lying fully inside the window.
+    A daily series still needs the per-day split, so nothing is known then.
+    """
+    if not contained or not ts_field or DAILY_SERIES:
+        return {}
+    return {unit: contained[unit] for unit in units if unit in contained}
+
+def count_note(ts_field):
+    """Processing note for a regular index, depending on how it was counted."""
+    if ts_field:
+        return f"filtered by {ts_field}"
+    return "no timestamp field, counted all docs"
+
+def build_result(name, kind, range_doc_count, avg_doc_size_bytes, start_dt, end_dt,
+                 ts_field, note=None, daily=None):
+    """
+    Turn a range doc count into the per-index result dict used by the report.
+    Per-day counts, when given, are kept with their byte estimates.
+    """
+    est_range_size_gb = (range_doc_count * avg_doc_size_bytes) / (1024 ** 3)
+    delta = end_dt - start_dt
+    days_diff = max(delta.days + (delta.seconds / 86400), 1)
+    ingest_per_day_gb = est_range_size_gb / days_diff
+
+    result = {
+        "name": name,
+        "type": kind,
+        "range_docs": range_doc_count,
+        "est_size_gb": est_range_size_gb,
+        "ingest_rate_gb": ingest_per_day_gb,
+        "ts_field": ts_field,
+    }
+    if note is not None:
+        result["note"] = note
+    if daily is not None:
+        result["daily_docs"] = dict(sorted(daily.items()))
+        result["daily_gb"] = {
+            day: count * avg_doc_size_bytes / (1024 ** 3)
+            for day, count in result["daily_docs"].items()
+        }
+    return result
+
+def daily_profile(daily_gb):
+    """
+    Summarize a {day: GB} series as min, mean, p95 (nearest rank), max and
+    the peak day. Returns None for an empty series.
+    """
+    if not daily_gb:
+        return None
+    values = sorted(daily_gb.values())
+    p95_rank = max(-(-len(values) * 95 // 100), 1)
+    peak_day = max(daily_gb, key=daily_gb.get)
+    return {
+        "days": len(values),
+        "min_gb": values[0],
+        "mean_gb": sum(values) / len(values),
+        "p95_gb": values[p95_rank - 1],
+        "max_gb": values[-1],
+        "peak_day": peak_day,
+    }
+
+def failure(name, kind, reason):
+    """Result entry for a target that could not be analyzed; listed separately in the report."""
+    return {"name": name, "type": kind, "error": reason}
+
+def collect(res, store, failures):
+    """File one finished result into the ResultStore, or into failures, and pass it to the sinks."""
+    emit_result(res)
+    if "error" in res:
+        failures.append(res)
+    else:
+        store.append(res)
+
+def split_results(results):
+    """
+    Split finished results into (ResultStore, failures).
+    Failures are sorted by name.
+    """
+    store, failures = ResultStore(), []
+    for res in results:
+        collect(res, store, failures)
+    failures.sort(key=lambda x: x["name"])
+    return store, failures
+
+class ResultStore:
+    """
+    Column-oriented store of analysis results.
+    Names, timestamp fields, notes and cluster names are interned in one
+    string table and kept as ids; types, doc counts and sizes live in typed
+    arrays. Totals, per-type subtotals, sorting and top-N are single C-level
+    passes (sum/compress/sorted/heapq with a column's __getitem__ as key)
+    over those buffers instead of Python loops over per-index dicts.
+    Fields added by optional passes (daily series, peak hour, sampled size)
+    are kept per row in a sparse side table.
+    """
+
+    KINDS = ("data_stream", "regular")
+    STRING_COLUMNS = ("name", "ts_field", "note", "cluster")
+    NUMBER_COLUMNS = ("range_docs", "est_size_gb", "ingest_rate_gb")
+
+    def __init__(self):
+        self.strings = []
+        self._string_ids = {}
+        self.columns = {
+            "name": array("l"),
+            "type": array("b"),
+            "range_docs": array("q"),
+            "est_size_gb": array("d"),
+            "ingest_rate_gb": array("d"),
+            "ts_field": array("l"),
+            "note": array("l"),
+            "cluster": array("l"),
+        }
+        self.extras = {}
+
+    def __len__(self):
+        return len(self.columns["type"])
+
+    def intern(self, value):
+        """Id of `value` in the string table (-1 for None), adding it if new."""
+        if value is None:
+            return -1
+        sid = self._string_ids.get(value)
+        if sid is None:
+            sid = len(self.strings)
+            self.strings.append(value)
+            self._string_ids[value] = sid
+        return sid
+
+    def append(self, result):
+        """Add one result dict as built by build_result()."""
+        row = len(self)
+        columns = self.columns
+        for field in self.STRING_COLUMNS:
+            columns[field].append(self.intern(result.get(field)))
+        columns["type"].append(self.KINDS.index(result["type"]))
+        for field in self.NUMBER_COLUMNS:
+            columns[field].append(result[field])
+        extra = {k: v for k, v in result.items() if k not in columns}
+        if extra:
+            self.extras[row] = extra
+
+    def extend(self, other):
+        """Append every row of another store."""
+        for row in range(len(other)):
+            self.append(other.row(row))
+
+    def get(self, row, field, default=None):
+        column = self.columns.get(field)
+        if column is None:
+            return self.extras.get(row, {}).get(field, default)
+        value = column[row]
+        if field == "type":
+            return self.KINDS[value]
+        if field in self.STRING_COLUMNS:
+            return default if value < 0 else self.strings[value]
+        return value
+
+    def set(self, row, field, value):
+        if field in self.STRING_COLUMNS:
+            self.columns[field][row] = self.intern(value)
+        elif field in self.columns:
+            self.columns[field][row] = value
+        else:
+            self.extras.setdefault(row, {})[field] = value
+
+    def row(self, row):
+        """Rebuild the result dict of one row, in build_result() order."""
+        result = {
+            "name": self.get(row, "name"),
+            "type": self.get(row, "type"),
+            "range_docs": self.columns["range_docs"][row],
+            "est_size_gb": self.columns["est_size_gb"][row],
+            "ingest_rate_gb": self.columns["ingest_rate_gb"][row],
+            "ts_field": self.get(row, "ts_field"),
+        }
+        for field in ("note", "cluster"):
+            value = self.get(row, field)
+            if value is not None:
+                result[field] = value
+        result.update(self.extras.get(row, {}))
+        return result
+
+    def label(self, row):
+        """Display name of a row: prefixed with its cluster in a fleet report."""
+        cluster = self.get(row, "cluster")
+        name = self.get(row, "name")
+        return f"{cluster}/{name}" if cluster is not None else name
+
+    def rows(self, kind=None):
+        """Row ids, optionally only those of one type."""
+        if kind is None:
+            return range(len(self))
+        code = self.KINDS.index(kind)
+        return list(compress(range(len(self)), map(code.__eq__, self.columns["type"])))
+
+    def total(self, column="ingest_rate_gb", kind=None):
+        values = self.columns[column]
+        if kind is None:
+            return sum(values)
+        code = self.KINDS.index(kind)
+        return sum(compress(values, map(code.__eq__, self.columns["type"])))
+
+    def count(self, kind=None):
+        if kind is None:
+            return len(self)
+        return self.columns["type"].count(self.KINDS.index(kind))
+
+    def order(self, column="ingest_rate_gb", kind=None):
+        """Row ids sorted by a numeric column, largest first."""
+        return sorted(self.rows(kind), key=self.columns[column].__getitem__, reverse=True)
+
+    def top(self, n, column="ingest_rate_gb", kind=None):
+        """The n row ids with the largest values of a numeric column."""
+        return heapq.nlargest(n, self.rows(kind), key=self.columns[column].__getitem__)
+
+    def top_extra(self, n, field):
+        """The n row ids with the largest value of a side-table field."""
+        rows = [row for row, extra in self.extras.items() if field in extra]
+        return heapq.nlargest(n, rows, key=lambda row: self.extras[row][field])
+
+# ---- Wire byte accounting and phase timing ----
+# Kept per cluster origin, so parallel cluster runs don't mix their phases
+_phase_clocks = {}
+_wire_lock = threading.Lock()
+_phase_local = threading.local()
+
+def set_phase_cluster(es_url):
+    """Attribute the set_phase() calls of this thread to the cluster at `es_url`."""
+    _phase_local.origin = url_origin(es_url)
+
+def _phase_clock(origin):
+    """Phase state of a cluster origin, created on first use; _wire_lock must be held."""
+    clock = _phase_clocks.get(origin)
+    if clock is None:
+        clock = _phase_clocks[origin] = {
+            "phase": "setup", "started": time.perf_counter(), "times": {}, "wire": {},
+        }
+    return clock
+
+def set_phase(name):
+    """
+    Attribute all following requests to this thread's cluster to the named
+    phase in the wire stats, and the wall time until the next set_phase()
+    to the phase timing.
+    """
+    with _wire_lock:
+        clock = _phase_clock(getattr(_phase_local, "origin", None))
+        now = time.perf_counter()
+        clock["times"][clock["phase"]] = (
+            clock["times"].get(clock["phase"], 0.0) + now - clock["started"]
+        )
+        clock["phase"] = name
+        clock["started"] = now
+
+def record_wire_bytes(r, *args, **kwargs):
+    """
+    Response hook: record request and response bytes for the current phase.
+    The body is consumed here so the raw (compressed) byte count is final.
+    """
+    decoded = len(r.content)
+    try:
+        received = r.raw.tell()
+    except Exception:
+        received = decoded
+    body = r.request.body or b""
+    sent = len(body.encode() if isinstance(body, str) else body)
+    add_wire_bytes(r.url, sent, received, decoded)
+    return r
+
+def add_wire_bytes(url, sent, received, decoded):
+    """
+    Count one request with its sent, received and decoded bytes in the
+    current phase of the cluster `url` points to.
+    """
+    with _wire_lock:
+        clock = _phase_clock(url_origin(url))
+        phase = clock["wire"].setdefault(
+            clock["phase"], {"requests": 0, "sent": 0, "received": 0, "decoded": 0}
+        )
+        phase["requests"] += 1
+        phase["sent"] += sent
+        phase["received"] += received
+        phase["decoded"] += decoded
+
+def wire_stats(es_url):
+    """Return a copy of a cluster's per-phase byte counters, in phase order."""
+    with _wire_lock:
+        clock = _phase_clock(url_origin(es_url))
+        return {name: dict(counters) for name, counters in clock["wire"].items()}
+
+def phase_times(es_url):
+    """
+    Wall seconds per phase of a cluster so far, in phase order, including
+    the running phase.
+    """
+    with _wire_lock:
+        clock = _phase_clock(url_origin(es_url))
+        times = dict(clock["times"])
+        times[clock["phase"]] = (
+            times.get(clock["phase"], 0.0) + time.perf_counter() - clock["started"]
+        )
+    return times
+
+# ================= ELASTIC: BULK STATS =================
+def fetch_bulk_stats(es_url, auth, data_streams, patterns=("*",)):
+    """
+    Prefetch primary docs stats for all indices with one _stats call per pattern.
+    Returns {name: (docs_count, total_size_in_bytes)} for every index, plus one
+    aggregated entry per data stream summed over its backing indices.
+    """
+    session = get_session(auth)
+    stats = {}
+
+    for pattern in patterns:
+        r = session.get(
+            f"{es_url}/{pattern}/_stats/docs",
+            params={
+                "level": "indices",
+                "expand_wildcards": "open,hidden",
+                "filter_path": "indices.*.primaries.docs",
+            },
+            timeout=60,
+        )
+        r.raise_for_status()
+        stats.update(parse_index_stats(r.json()))
+
+    return add_data_stream_totals(stats, data_streams)
+
+def parse_index_stats(data):
+    """Extract {index: (docs_count, total_size_in_bytes)} from a level=indices _stats response."""
+    stats = {}
+    for name, index_data in data.get("indices", {}).items():
+        docs = index_data.get("primaries", {}).get("docs", {})
+        stats[name] = (docs.get("count", 0), docs.get("total_size_in_bytes", 0))
+    return stats
+
+def add_data_stream_totals(stats, data_streams):
+    """
+    Add one entry per data stream to the stats map, summed over its backing
+    indices (failure store indices are not part of the stream's data).
+    """
+    ds_stats = {}
+    for name, (docs, size) in stats.items():
+        meta = data_streams.metadata(name)
+        if meta is None or meta["failure_store"]:
+            continue
+        ds_name = meta["data_stream"]
+        prev_docs, prev_size = ds_stats.get(ds_name, (0, 0))
+        ds_stats[ds_name] = (prev_docs + docs, prev_size + size)
+
+    stats.update(ds_stats)
+    return stats
+
+def get_primary_docs_stats(session, es_url, name, stats=None):
+    """
+    Return (docs_count, total_size_in_bytes) on primaries for an index or data stream.
+    Reads the prefetched stats map first and only calls _stats on a miss.
+    Returns None if the stats request fails.
+    """
+    if stats and name in stats:
+        return stats[name]
+
+    r = session.get(
+        f"{es_url}/{name}/_stats/docs",
+        params={"filter_path": "_all.primaries.docs"},
+        timeout=30,
+    )
+    if r.status_code != 200:
+        return None
+
+    return parse_primary_docs(r.json())
+
+def parse_primary_docs(data):
+    """Extract (docs_count, total_size_in_bytes) from a single-target _stats response."""
+    docs = data["_all"]["primaries"]["docs"]
+    return docs.get("count", 0), docs.get("total_size_in_bytes", 0)
+
+# ================= ELASTIC: DATA STREAM =================
+DATA_STREAM_FILTER = (
+    "data_streams.name,data_streams.generation,"
+    "data_streams.indices.index_name,data_streams.indices.index_uuid,"
+    "data_streams.failure_store.indices.index_name,"
+    "data_streams.failure_store.indices.index_uuid"
+)
+
+# Trailing generation number of a backing (.ds-) or failure store (.fs-) index
+INDEX_GENERATION_RE = re.compile(r"-(\d+)$")
+
+class DataStreams:
+    """
+    Data streams with their exact backing and failure store (.fs-) indices,
+    as listed by _data_stream. Behaves as the set of stream names.
+    owner() maps any of those indices to its stream with one dict lookup,
+    and metadata() exposes the index's uuid and generation.
+    """
+
+    def __init__(self):
+        self.backing = {}
+        self.failure_store = {}
+        self.generation = {}
+        self._indices = {}
+
+    def add(self, name, indices=(), failure_indices=(), generation=None):
+        """Register a stream; indices are _data_stream entries, oldest generation first."""
+        self.generation[name] = generation
+        for key, entries, failure in (
+            (self.backing, indices, False),
+            (self.failure_store, failure_indices, True),
+        ):
+            key[name] = []
+            for position, entry in enumerate(entries, 1):
+                index = entry["index_name"]
+                match = INDEX_GENERATION_RE.search(index)
+                self._indices[index] = {
+                    "data_stream": name,
+                    "uuid": entry.get("index_uuid"),
+                    "generation": int(match.group(1)) if match else position,
+                    "failure_store": failure,
+                }
+                key[name].append(index)
+
+    def __contains__(self, name):
+        return name in self.generation
+
+    def __iter__(self):
+        return iter(self.generation)
+
+    def __len__(self):
+        return len(self.generation)
+
+    def owner(self, index):
+        """The data stream a backing or failure store index belongs to, or None."""
+        meta = self._indices.get(index)
+        return meta["data_stream"] if meta else None
+
+    def metadata(self, index):
+        """{"data_stream", "uuid", "generation", "failure_store"} of an index, or None."""
+        return self._indices.get(index)
+
+    def write_index(self, name):
+        """
+        Current write index of a stream: the backing index of the stream's
+        generation, else the one with the highest generation.
+        """
+        indices = self.backing.get(name)
+        if not indices:
+            return None
+        for index in indices:
+            if self._indices[index]["generation"] == self.generation.get(name):
+                return index
+        return max(indices, key=lambda index: self._indices[index]["generation"])
+
+    def backing_indices(self):
+        """{data stream: [(backing index, index uuid), ...]}, oldest generation first."""
+        return {
+            name: [(index, self._indices[index]["uuid"]) for index in indices]
+            for name, indices in self.backing.items()
+        }
+
+def get_data_streams(es_url, auth):
+    """Retrieve all existing data streams with their backing indices."""
+    r = get_session(auth).get(
+        f"{es_url}/_data_stream",
+        params={"filter_path": DATA_STREAM_FILTER},
+        timeout=30,
+    )
+    r.raise_for_status()
+    return parse_data_streams(r.json())
+
+def parse_data_streams(data):
+    """Build DataStreams from a _data_stream response."""
+    streams = DataStreams()
+    for ds in data.get("data_streams", []):
+        streams.add(
+            ds["name"],
+            ds.get("indices", []),
+            (ds.get("failure_store") or {}).get("indices", []),
+            ds.get("generation"),
+        )
+    return streams
+
+def parse_epoch_millis(value):
+    """Epoch millis from an ES date setting (ISO string or millis), or None."""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp() * 1000
+    except ValueError:
+        return None
+
+def fetch_tsds_bounds(es_url, auth):
+    """
+    Time bounds of TSDS backing indices from index.time_series.start_time/end_time.
+    Returns {index: (start_millis, end_millis)}; non-TSDS indices are absent.
+    """
+    r = get_session(auth).get(
+        f"{es_url}/.ds-*/_settings/index.time_series.start_time,index.time_series.end_time",
+        params={
+            "expand_wildcards": "open,hidden",
+            "filter_path": "*.settings.index.time_series",
+        },
+        timeout=60,
+    )
+    r.raise_for_status()
+
+    bounds = {}
+    for name, data in r.json().items():
+        ts = data.get("settings", {}).get("index", {}).get("time_series", {})
+        start = parse_epoch_millis(ts.get("start_time"))
+        end = parse_epoch_millis(ts.get("end_time"))
+        if start is not None and end is not None:
+            bounds[name] = (start, end)
+    return bounds
+
+def fetch_time_bounds(es_url, auth, ts_fields, doc_counts=None):
+    """
+    Min/max timestamp (epoch millis) per concrete index, with one terms-on-_index
+    search per timestamp field. `ts_fields` maps index -> field.
+    Empty or failed indices are absent from the result. A `doc_counts` dict,
+    when given, is filled with the number of docs carrying the field per index.
+    """
+    session = get_session(auth)
+    groups = {}
+    for name, ts_field in ts_fields.items():
+        if ts_field:
+            groups.setdefault(ts_field, []).append(name)
+
+    jobs = [
+        (ts_field, chunk)
+        for ts_field, names in groups.items()
+        for chunk in chunk_index_names(names, TERMS_MAX_URL_CHARS)
+    ]
+
+    def run_group(job):
+        ts_field, chunk = job
+        body = {
+            "size": 0,
+            "aggs": {
+                "per_index": {
+                    "terms": {"field": "_index", "size": TERMS_AGG_MAX_BUCKETS},
+                    "aggs": {
+                        "min_ts": {"min": {"field": ts_field}},
+                        "max_ts": {"max": {"field": ts_field}},
+                        "no_ts": {"missing": {"field": ts_field}},
+                    },
+                }
+            },
+        }
+        try:
+            r = session.post(
+                f"{es_url}/{','.join(chunk)}/_search",
+                params={
+                    "ignore_unavailable": "true",
+                    "allow_no_indices": "true",
+                    "filter_path": "aggregations.per_index.buckets.key,"
+                                   "aggregations.per_index.buckets.doc_count,"
+                                   "aggregations.per_index.buckets.min_ts.value,"
+                                   "aggregations.per_index.buckets.max_ts.value,"
+                                   "aggregations.per_index.buckets.no_ts.doc_count",
+                },
+                json=body,
+                timeout=120,
+            )
+            if r.status_code != 200:
+                return {}, {}
+            buckets = r.json().get("aggregations", {}).get("per_index", {}).get("buckets", [])
+        except Exception:
+            return {}, {}
+
+        bounds, counts = {}, {}
+        for bucket in buckets:
+            low = bucket.get("min_ts", {}).get("value")
+            high = bucket.get("max_ts", {}).get("value")
+            if low is not None and high is not None:
+                bounds[bucket["key"]] = (low, high)
+                counts[bucket["key"]] = (
+                    bucket.get("doc_count", 0) - bucket.get("no_ts", {}).get("doc_count", 0)
+                )
+        return bounds, counts
+
+    bounds = {}
+    with ThreadPoolExecutor(max_workers=worker_count()) as executor:
+        for group_bounds, group_counts in executor.map(run_group, jobs):
+            bounds.update(group_bounds)
+            if doc_counts is not None:
+                doc_counts.update(group_counts)
+    return bounds
+
+def window_position(low_high, start_ms, end_ms):
+    """
+    Where (min, max) timestamp bounds lie relative to the window:
+    "inside", "outside" or "straddling"; None when the bounds are unknown.
+    """
+    if not low_high:
+        return None
+    low, high = low_high
+    if low > end_ms or high < start_ms:
+        return "outside"
+    if low >= start_ms and high <= end_ms:
+        return "inside"
+    return "straddling"
+
+def plan_contained_indices(es_url, auth, ts_fields, start_dt, end_dt):
+    """
+    Find the regular indices lying fully inside the window with one bounds
+    search per timestamp field. Returns {index: range count}.
+    """
+    doc_counts = {}
+    bounds = fetch_time_bounds(es_url, auth, ts_fields, doc_counts)
+    start_ms = start_dt.timestamp() * 1000
+    end_ms = end_dt.timestamp() * 1000
+    return {
+        name: doc_counts[name]
+        for name, low_high in bounds.items()
+        if name in doc_counts and window_position(low_high, start_ms, end_ms) == "inside"
+    }
+
+def plan_backing_indices(es_url, auth, data_streams, start_dt, end_dt, stats=None, cache=None):
+    """
+    Pick the backing indices of each data stream that can hold documents in the window.
+    TSDS generations use their start/end time settings; other generations use
+    min/max @timestamp, served from the StatsCache for rolled-over generations
+    (every backing index but the stream's write index).
+    Indices with unknown bounds are kept, empty indices are dropped.
+    Returns ({data stream: [backing index, ...]}, pruned count,
+    {backing index: range count} for the kept indices fully inside the window
+    whose timestamped doc count is known; the others are range-counted).
+    """
+    try:
+        bounds = fetch_tsds_bounds(es_url, auth)
+    except Exception:
+        bounds = {}
+
+    # Rolled-over generations never change: reuse their cached bounds
+    backing = data_streams.backing_indices()
+    rolled = {}
+    for ds_name, indices in backing.items():
+        write_index = data_streams.write_index(ds_name)
+        for name, uuid in indices:
+            if name != write_index and name not in bounds and uuid:
+                rolled[name] = uuid
+    doc_counts = {}
+    if cache is not None:
+        for name, uuid in rolled.items():
+            cached = cache.get_bounds(uuid, "@timestamp")
+            if cached:
+                low, high, ts_docs = cached
+                bounds[name] = (low, high)
+                if ts_docs is not None:
+                    doc_counts[name] = ts_docs
+
+    missing = {
+        name: "@timestamp"
+        for indices in backing.values()
+        for name, _ in indices
+        if name not in bounds and (stats or {}).get(name, (1, 0))[0] != 0
+    }
+    if missing:
+        fetched = fetch_time_bounds(es_url, auth, missing, doc_counts)
+        bounds.update(fetched)
+        if cache is not None:
+            cache.put_bounds([
+                (rolled[name], "@timestamp", low, high, doc_counts.get(name))
+                for name, (low, high) in fetched.items() if name in rolled
+            ])
+
+    start_ms = start_dt.timestamp() * 1000
+    end_ms = end_dt.timestamp() * 1000
+    plan, pruned, contained = {}, 0, {}
+    for ds_name, indices in backing.items():
+        keep = []
+        for name, _ in indices:
+            if (stats or {}).get(name, (1, 0))[0] == 0:
+                pruned += 1
+                continue
+            position = window_position(bounds.get(name), start_ms, end_ms)
+            if position == "outside":
+                pruned += 1
+                continue
+            if position == "inside" and name in doc_counts:
+                contained[name] = doc_counts[name]
+            keep.append(name)
+        plan[ds_name] = keep
+    return plan, pruned, contained
+
+def sum_primary_docs_stats(session, es_url, indices, stats=None):
+    """Sum (docs_count, total_size_in_bytes) over several indices, or None on failure."""
+    total_docs, total_bytes = 0, 0
+    for name in indices:
+        primary = get_primary_docs_stats(session, es_url, name, stats)
+        if primary is None:
+            return None
+        total_docs += primary[0]
+        total_bytes += primary[1]
+    return total_docs, total_bytes
+
+def process_data_stream(es_url, auth, ds_name, start_dt, end_dt, stats=None, ds_plan=None,
+                        contained=None):
+    """
+    Analyze a data stream using the aggregate primary shards method.
+    More accurate because avg_doc_size is calculated across all backing indices.
+    Uses the prefetched stats map when available instead of calling _stats.
+    With a backing index plan, only the generations overlapping the window are
+    counted and the avg doc size is weighted by those generations alone;
+    generations in `contained` take their known count instead of a query.
+    """
+    session = get_session(auth)
+
+    try:
+        if ds_plan is not None and ds_name in ds_plan:
+            concrete = ds_plan[ds_name]
+            if not concrete:
+                return None
+            primary = sum_primary_docs_stats(session, es_url, concrete, stats)
+            known = contained_units(concrete, contained, "@timestamp")
+            count_targets = chunk_index_names(
+                [name for name in concrete if name not in known], TERMS_MAX_URL_CHARS
+            )
+        else:
+            known = {}
+            # Stats aggregated across all backing indices
+            primary = get_primary_docs_stats(session, es_url, ds_name, stats)
+            count_targets = [[ds_name]]
+        if primary is None:
+            return failure(ds_name, "data_stream", "_stats request failed")
+
+        total_docs_primary, total_bytes_primary = primary
+        if total_docs_primary == 0:
+            return None
+
+        avg_doc_size_bytes = total_bytes_primary / total_docs_primary
+
+        # Count documents within the time range
+        range_doc_count = sum(known.values())
+        daily = None
+        for chunk in count_targets:
+            count, chunk_daily = post_range_count(
+                session, es_url, ",".join(chunk), "@timestamp", start_dt, end_dt
+            )
+            range_doc_count += count
+            if chunk_daily is not None:
+                daily = add_daily(daily or {}, chunk_daily)
+
+        if range_doc_count == 0:
+            return None
+
+        return build_result(
+            ds_name, "data_stream", range_doc_count, avg_doc_size_bytes,
+            start_dt, end_dt, "@timestamp", daily=daily,
+        )
+
+    except Exception as e:
+        return failure(ds_name, "data_stream", str(e))
+
+# ================= ELASTIC: REGULAR INDEX =================
+def get_regular_indices(es_url, auth, data_streams, filter_pattern=None):
+    """
+    Retrieve all regular indices (not data streams, not restored copies).
+    Backing indices from data streams (format .ds-*) are also excluded
+    since they are already counted via the data stream method.
+    """
+    r = get_session(auth).get(
+        f"{es_url}/_cat/indices/{cat_indices_expression(filter_pattern)}",
+        params=cat_indices_params(),
+        timeout=30,
+    )
+    r.raise_for_status()
+    return filter_regular_indices(r.json(), data_streams)
+
+def cat_indices_expression(filter_pattern=None):
+    """
+    Index expression for _cat/indices: the filter pattern (or *) followed by
+    every EXCLUDE_PREFIXES entry as a negated wildcard, e.g.
+    *,-.*,-partial-restored-*,-restored-*,-ilm-history*,-shrink-*
+    """
+    pattern = filter_pattern if filter_pattern else "*"
+    if not CAT_SERVER_SIDE_EXCLUDE:
+        return pattern
+    return ",".join([pattern] + [f"-{prefix}*" for prefix in EXCLUDE_PREFIXES])
+
+def cat_indices_params():
+    """Query parameters for _cat/indices; closed indices are skipped server-side."""
+    if not CAT_SERVER_SIDE_EXCLUDE:
+        return {"format": "json", "h": "index,status"}
+    return {"format": "json", "h": "index", "expand_wildcards": "open"}
+
+def resolve_indices(es_url, auth, filter_pattern=None):
+    """
+    Discover data streams and regular indices with one _resolve/index call.
+    The filter pattern selects data streams as well as regular indices.
+    Returns (DataStreams, sorted regular index names).
+    """
+    r = get_session(auth).get(
+        f"{es_url}/_resolve/index/{cat_indices_expression(filter_pattern)}",
+        params={"expand_wildcards": "open"},
+        timeout=30,
+    )
+    r.raise_for_status()
+    return parse_resolved_indices(r.json())
+
+def parse_resolved_indices(data):
+    """
+    Build (DataStreams, regular index names) from a _resolve/index response.
+    Backing index UUIDs are not part of the response. Indices that name a
+    data stream but are not among its backing indices are its failure store.
+    """
+    backing, failure_indices = {}, {}
+    for ds in data.get("data_streams", []):
+        backing[ds["name"]] = set(ds.get("backing_indices", []))
+
+    rows = []
+    for index in data.get("indices", []):
+        name = index["name"]
+        ds_name = index.get("data_stream")
+        if ds_name is not None:
+            if name not in backing.get(ds_name, ()):
+                failure_indices.setdefault(ds_name, []).append({"index_name": name})
+            continue
+        status = "close" if "closed" in index.get("attributes", []) else "open"
+        rows.append({"index": name, "status": status})
+
+    data_streams = DataStreams()
+    for ds in data.get("data_streams", []):
+        data_streams.add(
+            ds["name"],
+            [{"index_name": name} for name in ds.get("backing_indices", [])],
+            failure_indices.get(ds["name"], []),
+        )
+    return data_streams, filter_regular_indices(rows, data_streams)
+
+class PrefixMatcher:
+    """
+    Matches names against a fixed set of prefixes with one bisect per name.
+    Prefixes covered by a shorter one are dropped when it is built, which
+    leaves a sorted, prefix-free list: the only entry that can be a prefix
+    of a name is then the greatest one sorting at or before it.
+    """
+
+    def __init__(self, prefixes):
+        self.prefixes = []
+        for prefix in sorted(set(prefixes)):
+            if self.prefixes and prefix.startswith(self.prefixes[-1]):
+                continue
+            self.prefixes.append(prefix)
+
+    def __contains__(self, name):
+        i = bisect.bisect_right(self.prefixes, name)
+        return i > 0 and name.startswith(self.prefixes[i - 1])
+
+def filter_regular_indices(rows, data_streams):
+    """
+    Keep the names of open, non-system, non-backing indices from _cat/indices rows.
+    `data_streams` is the DataStreams from discovery. Returns the names sorted.
+    Still applied when cat_indices_expression() already excluded them server-side.
+    """
+    # System & restored prefixes, matched in O(log prefixes) per index
+    excluded = PrefixMatcher(EXCLUDE_PREFIXES)
+
+    regular = []
+    for item in rows:
+        name = item.get("index", "")
+        status = item.get("status", "")
+
+        # Skip closed indices (cannot be queried)
+        if status == "close":
+            continue
+
+        # Skip system & restored prefixes
+        if name in excluded:
+            continue
+
+        # Skip backing and failure store indices of data streams (exact lookup)
+        if data_streams.owner(name) is not None:
+            continue
+
+        # Skip if the name itself is a data stream (already handled)
+        if name in data_streams:
+            continue
+
+        regular.append(name)
+
+    return sorted(regular)
+
+
+def detect_timestamp_field(session, es_url, index):
+    """
+    Detect the available timestamp field from the index mapping.
+    Priority: @timestamp -> timestamp -> event.created -> time -> date
+    Returns None if no timestamp field is found.
+    """
+    try:
+        r = session.get(
+            f"{es_url}/{index}/_mapping",
+            params={"filter_path": mapping_filter_path()},
+            timeout=15,
+        )
+        if r.status_code != 200:
+            return None
+        return find_timestamp_field(r.json())
+
+    except Exception:
+        pass
+
+    return None
+
+def mapping_filter_path():
+    """filter_path that keeps only the mapping branches of the candidate fields."""
+    return ",".join(
+        "*.mappings.properties." + ".properties.".join(c.split("."))
+        for c in TIMESTAMP_CANDIDATES
+    )
+
+def find_timestamp_field(mapping):
+    """Return the first timestamp candidate present in a _mapping response, or None."""
+    all_props = {}
+    for idx_data in mapping.values():
+        props = idx_data.get("mappings", {}).get("properties", {})
+        all_props.update(props)
+
+    for candidate in TIMESTAMP_CANDIDATES:
+        parts = candidate.split(".")
+        current = all_props
+        found = True
+        for part in parts:
+            if part in current:
+                current = current[part].get("properties", current[part])
+            else:
+                found = False
+                break
+        if found:
+            return candidate
+
+    return None
+
+
+def detect_timestamp_fields_field_caps(es_url, auth, indices):
+    """
+    Detect timestamp fields for many indices with _field_caps instead of _mapping.
+    One request per URL-sized chunk of indices asks only for the candidate
+    fields; the per-type `indices` breakdown (forced by include_unmapped) tells
+    which index has which candidate as a date or date_nanos field.
+    Returns {index: ts_field or None}. Raises if a chunk request fails.
+    """
+    session = get_session(auth)
+    ts_fields = {}
+
+    for chunk in chunk_index_names(indices, TERMS_MAX_URL_CHARS):
+        r = session.get(
+            f"{es_url}/{','.join(chunk)}/_field_caps",
+            params=field_caps_params(),
+            timeout=60,
+        )
+        r.raise_for_status()
+        ts_fields.update(parse_field_caps(r.json(), chunk))
+
+    return {idx: ts_fields.get(idx) for idx in indices}
+
+def field_caps_params(fields=TIMESTAMP_CANDIDATES):
+    """Query parameters for a timestamp-detection _field_caps request."""
+    return {
+        "fields": ",".join(fields),
+        "include_unmapped": "true",
+        "ignore_unavailable": "true",
+        # A per-type entry only lists "indices" when the field has several
+        # types across the request, so the entries are kept whole
+        "filter_path": "indices,fields",
+    }
+
+def parse_field_caps(data, requested):
+    """
+    Resolve {index: timestamp field} from a _field_caps response.
+    Indices without a date-typed candidate are left out.
+    """
+    ts_fields = {}
+    all_indices = data.get("indices", requested)
+    fields = data.get("fields", {})
+
+    for candidate in TIMESTAMP_CANDIDATES:
+        for field_type, caps in fields.get(candidate, {}).items():
+            if field_type not in ("date", "date_nanos"):
+                continue
+            for index in caps.get("indices") or all_indices:
+                ts_fields.setdefault(index, candidate)
+
+    return ts_fields
+
+def confirm_timestamp_fields(es_url, auth, ts_fields):
+    """
+    Keep the entries of `ts_fields` (index -> expected field) whose index maps
+    that field as a date, with one _field_caps request per URL-sized chunk
+    asking for the expected fields only. Raises if a chunk request fails.
+    """
+    session = get_session(auth)
+    confirmed = {}
+
+    for chunk in chunk_index_names(list(ts_fields), TERMS_MAX_URL_CHARS):
+        r = session.get(
+            f"{es_url}/{','.join(chunk)}/_field_caps",
+            params=field_caps_params(sorted({ts_fields[idx] for idx in chunk})),
+            timeout=60,
+        )
+        r.raise_for_status()
+        detected = parse_field_caps(r.json(), chunk)
+        confirmed.update({
+            idx: ts_fields[idx] for idx in chunk if detected.get(idx) == ts_fields[idx]
+        })
+
+    return confirmed
+
+def process_regular_index(es_url, auth, index_name, start_dt, end_dt, stats=None,
+                          ts_fields=None, contained=None):
+    """
+    Analyze a regular index with automatic timestamp field detection.
+    Falls back to counting all documents if no timestamp field is found.
+    Uses the prefetched stats map when available instead of calling _stats,
+    and the pre-detected timestamp fields instead of reading the mapping.
+    An index in `contained` lies fully inside the window and is not counted.
+    """
+    session = get_session(auth)
+
+    try:
+        primary = get_primary_docs_stats(session, es_url, index_name, stats)
+        if primary is None:
+            return failure(index_name, "regular", "_stats request failed")
+
+        total_docs_primary, total_bytes_primary = primary
+        if total_docs_primary == 0:
+            return None
+
+        avg_doc_size_bytes = total_bytes_primary / total_docs_primary
+
+        if ts_fields is not None and index_name in ts_fields:
+            ts_field = ts_fields[index_name]
+        else:
+            ts_field = detect_timestamp_field(session, es_url, index_name)
+
+        known = contained_units([index_name], contained, ts_field)
+        if known:
+            range_doc_count, daily = known[index_name], None
+        else:
+            range_doc_count, daily = post_range_count(
+                session, es_url, index_name, ts_field, start_dt, end_dt
+            )
+        if range_doc_count == 0:
+            return None
+
+        return build_result(
+            index_name, "regular", range_doc_count, avg_doc_size_bytes,
+            start_dt, end_dt, ts_field, note=count_note(ts_field), daily=daily,
+        )
+
+    except Exception as e:
+        return failure(index_name, "regular", str(e))
+
+def detect_timestamp_fields(es_url, auth, indices):
+    """
+    Detect the timestamp field of many regular indices.
+    Indices covered by the template memo (TEMPLATE_TS_CACHE) are answered
+    from their index template; the rest use _field_caps when
+    TIMESTAMP_DETECTION is "field_caps" and fall back to reading each
+    mapping in parallel if that fails.
+    """
+    ts_fields = template_timestamp_fields(es_url, auth, indices)
+    pending = [idx for idx in indices if idx not in ts_fields]
+    if not pending:
+        return ts_fields
+
+    if TIMESTAMP_DETECTION == "field_caps":
+        try:
+            ts_fields.update(detect_timestamp_fields_field_caps(es_url, auth, pending))
+            return ts_fields
+        except Exception as e:
+            print(f"      _field_caps detection failed, reading mappings instead: {e}")
+
+    session = get_session(auth)
+    with ThreadPoolExecutor(max_workers=worker_count()) as executor:
+        futures = {
+            executor.submit(detect_timestamp_field, session, es_url, idx): idx
+            for idx in pending
+        }
+        ts_fields.update({futures[f]: f.result() for f in as_completed(futures)})
+    return ts_fields
+
+# ================= ELASTIC: BATCHED COUNTS =================
+def run_msearch(es_url, auth, bodies, filter_path, batch_size=None):
+    """
+    Send many search bodies through _msearch, `batch_size` per request, with
+    batches running in parallel. `bodies` maps index name -> search body.
+    Returns {index name: sub-response}, with None for items whose sub-search
+    failed so one bad index never sinks the rest of its batch.
+    """
+    batch_size = batch_size or MSEARCH_BATCH_SIZE
+    session = get_session(auth)
+    names = list(bodies)
+    batches = [names[i:i + batch_size] for i in range(0, len(names), batch_size)]
+
+    def run_batch(batch):
+        lines = []
+        for name in batch:
+            lines.append(json.dumps({"index": name}))
+            lines.append(json.dumps(bodies[name]))
+        body = "\n".join(lines) + "\n"
+
+        try:
+            r = session.post(
+                f"{es_url}/_msearch",
+                params={"filter_path": f"responses.status,responses.error.type,{filter_path}"},
+                data=body,
+                headers={"Content-Type": "application/x-ndjson"},
+                timeout=120,
+            )
+            if r.status_code != 200:
+                return {name: None for name in batch}
+            responses = r.json().get("responses", [])
+        except Exception:
+            return {name: None for name in batch}
+
+        out = {}
+        for name, resp in zip(batch, responses):
+            out[name] = None if "error" in resp else resp
+        # Missing trailing responses count as failures
+        for name in batch[len(responses):]:
+            out[name] = None
+        return out
+
+    responses = {}
+    with ThreadPoolExecutor(max_workers=worker_count()) as executor:
+        for batch_responses in executor.map(run_batch, batches):
+            responses.update(batch_responses)
+    return responses
+
+def msearch_counts(es_url, auth, searches, batch_size=None):
+    """
+    Run many count queries through _msearch instead of one _count per index.
+    `searches` maps index name -> query clause; each is sent with size 0 and
+    exact hit totals. Returns {index name: count}, None where a sub-search failed.
+    """
+    bodies = {
+        name: {"size": 0, "track_total_hits": True, "query": query}
+        for name, query in searches.items()
+    }
+    responses = run_msearch(es_url, auth, bodies, "responses.hits.total", batch_size)
+
+    counts = {}
+    for name, resp in responses.items():
+        if resp is None:
+            counts[name] = None
+            continue
+        total = resp.get("hits", {}).get("total", 0)
+        counts[name] = total.get("value", 0) if isinstance(total, dict) else total
+    return counts
+
+def msearch_daily_counts(es_url, auth, searches, batch_size=None, time_zone="UTC"):
+    """
+    Per-day document counts through _msearch with a calendar-day date_histogram.
+    `searches` maps name -> (ts_field, start_dt, end_dt).
+    Returns {name: {"YYYY-MM-DD": count}}, with None where a sub-search failed.
+    """
+    bodies = {
+        name: daily_histogram_body(ts_field, day_start, day_end, time_zone)
+        for name, (ts_field, day_start, day_end) in searches.items()
+    }
+    responses = run_msearch(
+        es_url, auth, bodies,
+        "responses.aggregations.days.buckets.key_as_string,"
+        "responses.aggregations.days.buckets.doc_count",
+        batch_size,
+    )
+    return {
+        name: None if resp is None else parse_daily_buckets(resp)
+        for name, resp in responses.items()
+    }
+
+def chunk_index_names(names, max_chars):
+    """Split index names into comma-joined groups that fit in one URL."""
+    chunks, current, length = [], [], 0
+    for name in names:
+        if current and length + len(name) + 1 > max_chars:
+            chunks.append(current)
+            current, length = [], 0
+        current.append(name)
+        length += len(name) + 1
+    if current:
+        chunks.append(current)
+    return chunks
+
+def terms_agg_counts(es_url, auth, ts_fields, start_dt, end_dt, daily_time_zone=None,
+                     data_streams=None):
+    """
+    Count documents in the window for many indices with one search per timestamp field.
+    `ts_fields` maps index/data stream name -> timestamp field (None = match_all).
+    Names sharing a field are searched together with a terms aggregation on
+    _index; backing index buckets are summed back into their data stream
+    (looked up in `data_streams`).
+    With `daily_time_zone`, a daily date_histogram sub-aggregation also
+    splits each timestamped count per calendar day.
+    Returns ({name: count}, {name: {"YYYY-MM-DD": count}}), with None counts
+    for names whose group search failed.
+    """
+    session = get_session(auth)
+
+    groups = {}
+    for name, ts_field in ts_fields.items():
+        groups.setdefault(ts_field, []).append(name)
+
+    # Index buckets times day buckets must stay under the search.max_buckets limit
+    per_search = TERMS_AGG_MAX_BUCKETS
+    if daily_time_zone:
+        per_search = max(TERMS_AGG_MAX_BUCKETS // (len(window_days(start_dt, end_dt)) + 1), 1)
+
+    jobs = [
+        (ts_field, chunk[i:i + per_search])
+        for ts_field, names in groups.items()
+        for chunk in chunk_index_names(names, TERMS_MAX_URL_CHARS)
+        for i in range(0, len(chunk), per_search)
+    ]
+
+    def run_group(job):
+        ts_field, chunk = job
+        members = set(chunk)
+        daily = bool(daily_time_zone and ts_field)
+        per_index = {"terms": {"field": "_index", "size": TERMS_AGG_MAX_BUCKETS}}
+        filter_path = ("aggregations.per_index.buckets.key,"
+                       "aggregations.per_index.buckets.doc_count")
+        if daily:
+            per_index["aggs"] = daily_histogram_body(
+                ts_field, start_dt, end_dt, daily_time_zone
+            )["aggs"]
+            filter_path += ",aggregations.per_index.buckets.days.buckets.key_as_string," \
+                           "aggregations.per_index.buckets.days.buckets.doc_count"
+        body = {
+            "size": 0,
+            "track_total_hits": False,
+            "query": range_query(ts_field, start_dt, end_dt),
+            "aggs": {"per_index": per_index},
+        }
+
+        try:
+            r = session.post(
+                f"{es_url}/{','.join(chunk)}/_search",
+                params={
+                    "ignore_unavailable": "true",
+                    "allow_no_indices": "true",
+                    "filter_path": filter_path,
+                },
+                json=body,
+                timeout=120,
+            )
+            if r.status_code != 200:
+                return {name: None for name in chunk}, {}
+            # filter_path drops the aggregation entirely when it has no buckets
+            buckets = r.json().get("aggregations", {}).get("per_index", {}).get("buckets", [])
+        except Exception:
+            return {name: None for name in chunk}, {}
+
+        counts = {name: 0 for name in chunk}
+        days = {name: {} for name in chunk} if daily else {}
+        for bucket in buckets:
+            index = bucket["key"]
+            if index in members:
+                owner = index
+            else:
+                owner = data_streams.owner(index) if data_streams is not None else None
+            if owner in members:
+                counts[owner] += bucket["doc_count"]
+                if daily:
+                    add_daily(days[owner], parse_daily_buckets({"aggregations": bucket}))
+        return counts, days
+
+    counts, daily = {}, {}
+    with ThreadPoolExecutor(max_workers=worker_count()) as executor:
+        for group_counts, group_daily in executor.map(run_group, jobs):
+            counts.update(group_counts)
+            daily.update(group_daily)
+    return counts, daily
+
+def analyze_batched(es_url, auth, targets, start_dt, end_dt, stats=None,
+                    mode="msearch", batch_size=None, cache=None, index_meta=None,
+                    ledger=None, ds_plan=None, contained=None, data_streams=None):
+    """
+    Analyze data streams and regular indices with batched range counts.
+    `targets` is a list of (name, type, ts_field) tuples. Average doc size
+    comes from the prefetched stats; counts come from msearch_counts or,
+    with mode "terms", from terms_agg_counts.
+    With a StatsCache, targets are split into their concrete indices and
+    only indices without a reusable cache entry are counted. With an
+    IngestLedger, targets with a timestamp field are assembled from per-day
+    counts and only days not yet closed in the ledger are queried. With a
+    backing index plan, data streams are counted over their overlapping
+    generations only. Concrete indices in `contained` lie fully inside the
+    window and take their known count instead of a query. With DAILY_SERIES,
+    timestamped targets are counted per day (from the ledger, or a
+    date_histogram instead of a cached total). `data_streams` maps backing
+    indices to their stream.
+    Returns the same result and failure dicts as process_data_stream/process_regular_index.
+    """
+    session = get_session(auth)
+    searches = {}
+    ts_fields = {}
+    avg_sizes = {}
+    results = []
+
+    # Searchable unit (target or concrete index) -> owning target
+    units = {}
+    cached_counts = {}
+    ledger_targets = {}
+    members = backing_indices_by_stream(stats, data_streams) if cache is not None else {}
+    members.update(ds_plan or {})
+
+    for name, kind, ts_field in targets:
+        planned = kind == "data_stream" and ds_plan is not None and name in ds_plan
+        if planned and not ds_plan[name]:
+            continue
+        try:
+            if planned:
+                primary = sum_primary_docs_stats(session, es_url, ds_plan[name], stats)
+            else:
+                primary = get_primary_docs_stats(session, es_url, name, stats)
+        except Exception:
+            primary = None
+        if primary is None:
+            results.append(failure(name, kind, "_stats request failed"))
+            continue
+        if primary[0] == 0:
+            continue
+
+        total_docs_primary, total_bytes_primary = primary
+        avg_sizes[name] = total_bytes_primary / total_docs_primary
+
+        if ledger is not None and ts_field:
+            ledger_targets[name] = (ts_field, avg_sizes[name])
+            continue
+
+        concrete = members.get(name, []) if kind == "data_stream" else [name]
+        known = contained_units(concrete, contained, ts_field)
+        if known:
+            cached_counts[name] = sum(known.values())
+            concrete = [unit for unit in concrete if unit not in known]
+
+        # Cached entries hold window totals only, not the per-day split
+        if cache is not None and not (DAILY_SERIES and ts_field):
+            cached_count, pending = cache.resolve(
+                concrete, ts_field, start_dt, end_dt, stats, index_meta
+            )
+            cached_counts[name] = cached_counts.get(name, 0) + cached_count
+            if not concrete and not known:
+                pending = [name]
+        elif planned or known:
+            pending = concrete
+        else:
+            pending = [name]
+
+        for unit in pending:
+            units[unit] = name
+            searches[unit] = range_query(ts_field, start_dt, end_dt)
+            ts_fields[unit] = ts_field
+
+    unit_daily = {}
+    if mode == "terms":
+        counts, unit_daily = terms_agg_counts(
+            es_url, auth, ts_fields, start_dt, end_dt,
+            DAILY_TIME_ZONE if DAILY_SERIES else None, data_streams,
+        )
+    elif DAILY_SERIES:
+        daily_searches = {
+            unit: (ts_fields[unit], start_dt, end_dt) for unit in searches if ts_fields[unit]
+        }
+        unit_daily = msearch_daily_counts(
+            es_url, auth, daily_searches, batch_size, DAILY_TIME_ZONE
+        )
+        counts = msearch_counts(es_url, auth, {
+            unit: query for unit, query in searches.items() if unit not in daily_searches
+        }, batch_size)
+        for unit, days in unit_daily.items():
+            counts[unit] = None if days is None else sum(days.values())
+    else:
+        counts = msearch_counts(es_url, auth, searches, batch_size)
+
+    if cache is not None:
+        cache.store_counts(
+            es_url, auth, counts, ts_fields, units, start_dt, end_dt, stats, index_meta
+        )
+
+    ledger_totals, failed = {}, set()
+    if ledger_targets:
+        ledger_totals, failed = ledger.update(
+            es_url, auth, ledger_targets, start_dt, end_dt, batch_size
+        )
+
+    totals = dict(cached_counts)
+    daily = {}
+    for name, (docs, est_bytes) in ledger_totals.items():
+        totals[name] = docs
+        if docs:
+            # Byte estimates were recorded day by day with that day's avg doc size
+            avg_sizes[name] = est_bytes / docs
+        if DAILY_SERIES:
+            daily[name] = ledger.window_daily(
+                url_origin(es_url), name, ledger_targets[name][0], start_dt, end_dt
+            )
+    for unit, name in units.items():
+        if counts.get(unit) is None:
+            failed.add(name)
+        else:
+            totals[name] = totals.get(name, 0) + counts[unit]
+            if unit_daily.get(unit) is not None:
+                add_daily(daily.setdefault(name, {}), unit_daily[unit])
+
+    for name, kind, ts_field in targets:
+        if name not in avg_sizes:
+            continue
+        if name in failed:
+            results.append(failure(name, kind, f"{mode} range count failed"))
+            continue
+        range_doc_count = totals.get(name, 0)
+        if range_doc_count == 0:
+            continue
+        note = count_note(ts_field) if kind == "regular" else None
+        results.append(build_result(
+            name, kind, range_doc_count, avg_sizes[name],
+            start_dt, end_dt, ts_field, note=note, daily=daily.get(name),
+        ))
+    return results
+
+# ================= STATS CACHE =================
+def backing_indices_by_stream(stats, data_streams):
+    """Group the backing indices present in the stats map by data stream name."""
+    if data_streams is None:
+        return {}
+    members = {}
+    for name, indices in data_streams.backing.items():
+        present = [index for index in indices if index in (stats or {})]
+        if present:
+            members[name] = present
+    return members
+
+def fetch_index_metadata(es_url, auth, data_streams=None):
+    """
+    Fetch UUID, write-block status and TSDS end time of every open index with
+    one _settings call.
+    Returns {index: {"uuid", "read_only", "backing", "write_index", "end_time"}},
+    where backing and write_index come from `data_streams`: write_index marks the
+    current write index of a data stream. end_time (epoch millis) is set for
+    TSDS backing indices only.
+    """
+    r = get_session(auth).get(
+        f"{es_url}/_all/_settings/index.uuid,index.blocks.*,index.time_series.end_time",
+        params={
+            "expand_wildcards": "open,hidden",
+            "filter_path": "*.settings.index.uuid,*.settings.index.blocks,"
+                           "*.settings.index.time_series.end_time",
+        },
+        timeout=60,
+    )
+    r.raise_for_status()
+
+    meta = {}
+    for name, data in r.json().items():
+        settings = data.get("settings", {}).get("index", {})
+        blocks = settings.get("blocks", {})
+        read_only = any(
+            str(blocks.get(b, "false")).lower() == "true"
+            for b in ("write", "read_only", "read_only_allow_delete")
+        )
+        stream_meta = data_streams.metadata(name) if data_streams is not None else None
+        meta[name] = {
+            "uuid": settings.get("uuid"),
+            "read_only": read_only,
+            "backing": stream_meta is not None and not stream_meta["failure_store"],
+            "write_index": False,
+            "end_time": parse_epoch_millis(settings.get("time_series", {}).get("end_time")),
+        }
+
+    for ds_name in data_streams or ():
+        name = data_streams.write_index(ds_name)
+        if name in meta:
+            meta[name]["write_index"] = True
+    return meta
+
+def fetch_max_timestamps(es_url, auth, ts_fields):
+    """
+    Newest timestamp (epoch millis) per index, with one terms-on-_index search
+    per timestamp field. `ts_fields` maps index -> field. Missing on failure.
+    """
+    session = get_session(auth)
+    groups = {}
+    for name, ts_field in ts_fields.items():
+        if ts_field:
+            groups.setdefault(ts_field, []).append(name)
+
+    newest = {}
+    for ts_field, names in groups.items():
+        for chunk in chunk_index_names(names, TERMS_MAX_URL_CHARS):
+            body = {
+                "size": 0,
+                "aggs": {
+                    "per_index": {
+                        "terms": {"field": "_index", "size": TERMS_AGG_MAX_BUCKETS},
+                        "aggs": {"max_ts": {"max": {"field": ts_field}}},
+                    }
+                },
+            }
+            try:
+                r = session.post(
+                    f"{es_url}/{','.join(chunk)}/_search",
+                    params={
+                        "ignore_unavailable": "true",
+                        "filter_path": "aggregations.per_index.buckets.key,"
+                                       "aggregations.per_index.buckets.max_ts.value",
+                    },
+                    json=body,
+                    timeout=120,
+                )
+                if r.status_code != 200:
+                    continue
+                buckets = r.json().get("aggregations", {}).get("per_index", {}).get("buckets", [])
+            except Exception:
+                continue
+            for bucket in buckets:
+                value = bucket.get("max_ts", {}).get("value")
+                if value is not None:
+                    newest[bucket["key"]] = value
+    return newest
+
+class StatsCache:
+    """
+    SQLite store of per-index range counts, keyed by index UUID, analysis window
+    and timestamp field, so repeat runs only query indices that may have changed.
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        with self._lock:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS index_counts (
+                    uuid TEXT NOT NULL,
+                    window_start TEXT NOT NULL,
+                    window_end TEXT NOT NULL,
+                    ts_field TEXT NOT NULL,
+                    index_name TEXT NOT NULL,
+                    docs_count INTEGER NOT NULL,
+                    primary_bytes INTEGER NOT NULL,
+                    range_count INTEGER NOT NULL,
+                    max_timestamp REAL,
+                    cached_at REAL NOT NULL,
+                    PRIMARY KEY (uuid, window_start, window_end, ts_field)
+                )
+                """
+            )
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS index_bounds (
+                    uuid TEXT NOT NULL,
+                    ts_field TEXT NOT NULL,
+                    min_ts REAL NOT NULL,
+                    max_ts REAL NOT NULL,
+                    ts_docs INTEGER,
+                    PRIMARY KEY (uuid, ts_field)
+                )
+                """
+            )
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(index_bounds)")]
+            if "ts_docs" not in columns:
+                self._conn.execute("ALTER TABLE index_bounds ADD COLUMN ts_docs INTEGER")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def get(self, uuid, start_dt, end_dt, ts_field):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT docs_count, primary_bytes, range_count, max_timestamp, cached_at "
+                "FROM index_counts WHERE uuid = ? AND window_start = ? "
+                "AND window_end = ? AND ts_field = ?",
+                (uuid, start_dt.isoformat(), end_dt.isoformat(), ts_field or ""),
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ("docs_count", "primary_bytes", "range_count", "max_timestamp", "cached_at")
+        return dict(zip(keys, row))
+
+    def put_many(self, rows):
+        """Insert or replace (uuid, start, end, ts_field, index, docs, bytes, count, max_ts) rows."""
+        cached_at = datetime.now(timezone.utc).timestamp() * 1000
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO index_counts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (uuid, start_dt.isoformat(), end_dt.isoformat(), ts_field or "",
+                     index, docs, size, count, max_ts, cached_at)
+                    for uuid, start_dt, end_dt, ts_field, index, docs, size, count, max_ts in rows
+                ],
+            )
+            self._conn.commit()
+
+    def get_bounds(self, uuid, ts_field):
+        """
+        Cached (min, max, ts_docs) of an immutable index, or None: timestamp
+        bounds in epoch millis and the number of docs carrying the field
+        (None for entries cached before it was recorded).
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT min_ts, max_ts, ts_docs FROM index_bounds "
+                "WHERE uuid = ? AND ts_field = ?",
+                (uuid, ts_field),
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def put_bounds(self, rows):
+        """Insert or replace (uuid, ts_field, min_ts, max_ts, ts_docs) rows."""
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO index_bounds VALUES (?, ?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+
+    def resolve(self, concrete, ts_field, start_dt, end_dt, stats, index_meta):
+        """
+        Split a target's concrete indices into a cached range count and the
+        indices that still need a query. Returns (cached_count, pending).
+        """
+        cached_count = 0
+        pending = []
+        for index in concrete:
+            meta = (index_meta or {}).get(index)
+            entry = self.get(meta["uuid"], start_dt, end_dt, ts_field) if meta else None
+            if entry and self._reusable(entry, meta, (stats or {}).get(index)):
+                cached_count += entry["range_count"]
+                self.hits += 1
+            else:
+                pending.append(index)
+                self.misses += 1
+        return cached_count, pending
+
+    @staticmethod
+    def _reusable(entry, meta, current_stats):
+        if meta["read_only"]:
+            return True
+        if meta["backing"] and not meta["write_index"]:
+            # A TSDS generation accepts writes until its end_time, so only
+            # counts cached after that are final
+            end_time = meta.get("end_time")
+            if end_time is None or end_time <= entry["cached_at"]:
+                return True
+        # Unchanged doc count and newest doc older than the cached run: idle index
+        return (
+            current_stats is not None
+            and entry["docs_count"] == current_stats[0]
+            and entry["max_timestamp"] is not None
+            and entry["max_timestamp"] < entry["cached_at"]
+        )
+
+    def store_counts(self, es_url, auth, counts, ts_fields, units, start_dt, end_dt,
+                     stats, index_meta):
+        """Cache the fresh counts of every concrete index that was just queried."""
+        index_meta = index_meta or {}
+        stats = stats or {}
+        fresh = {
+            unit: count for unit, count in counts.items()
+            if count is not None and unit in index_meta and index_meta[unit]["uuid"]
+        }
+
+        # Newest timestamp only matters for indices that may still receive writes
+        mutable = {
+            unit: ts_fields.get(unit) for unit in fresh
+            if not index_meta[unit]["read_only"] and not index_meta[unit]["backing"]
+        }
+        newest = fetch_max_timestamps(es_url, auth, mutable) if mutable else {}
+
+        rows = []
+        for unit, count in fresh.items():
+            docs, size = stats.get(unit, (0, 0))
+            rows.append((
+                index_meta[unit]["uuid"], start_dt, end_dt, ts_fields.get(unit),
+                unit, docs, size, count, newest.get(unit),
+            ))
+        if rows:
+            self.put_many(rows)
+
+def open_stats_cache(es_url, auth, data_streams=None):
+    """
+    Open the on-disk stats cache and load the index metadata it is keyed by.
+    Returns (None, None) when the cache is disabled or unavailable.
+    """
+    if not STATS_CACHE:
+        return None, None
+    try:
+        index_meta = fetch_index_metadata(es_url, auth, data_streams)
+        return StatsCache(STATS_CACHE_PATH), index_meta
+    except Exception as e:
+        print(f"      Stats cache disabled for this run: {e}")
+        return None, None
+
+# ================= TEMPLATE MEMO =================
+class TemplateCache:
+    """
+    SQLite store of the timestamp field each index template maps, keyed by
+    cluster and template name. An entry is valid while the template's
+    version key (its version plus those of its component templates) is
+    unchanged.
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS template_ts_fields (
+                    cluster TEXT NOT NULL,
+                    template TEXT NOT NULL,
+                    version_key TEXT NOT NULL,
+                    ts_field TEXT NOT NULL,
+                    cached_at REAL NOT NULL,
+                    PRIMARY KEY (cluster, template)
+                )
+                """
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def get(self, cluster, template, version_key):
+        """
+        Cached field of a template ("" when it maps no candidate), or None
+        when there is no entry for this version key.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT ts_field FROM template_ts_fields "
+                "WHERE cluster = ? AND template = ? AND version_key = ?",
+                (cluster, template, version_key),
+            ).fetchone()
+        return row[0] if row else None
+
+    def put_many(self, cluster, rows):
+        """Insert or replace (template, version_key, ts_field or None) rows."""
+        if not rows:
+            return
+        cached_at = datetime.now(timezone.utc).timestamp() * 1000
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO template_ts_fields VALUES (?, ?, ?, ?, ?)",
+                [
+                    (cluster, template, version_key, ts_field or "", cached_at)
+                    for template, version_key, ts_field in rows
+                ],
+            )
+            self._conn.commit()
+
+def fetch_index_templates(es_url, auth):
+    """
+    Fetch name, index patterns, priority, version and component templates of
+    every composable index template, plus the version of every component
+    template. Returns ({template: {...}}, {component: version}).
+    """
+    session = get_session(auth)
+    r = session.get(
+        f"{es_url}/_index_template",
+        params={
+            "filter_path": "index_templates.name,"
+                           "index_templates.index_template.index_patterns,"
+                           "index_templates.index_template.priority,"
+                           "index_templates.index_template.version,"
+                           "index_templates.index_template.composed_of,"
+                           "index_templates.index_template.data_stream"
+        },
+        timeout=30,
+    )
+    r.raise_for_status()
+    templates = {}
+    for entry in r.json().get("index_templates", []):
+        body = entry.get("index_template", {})
+        templates[entry["name"]] = {
+            "patterns": body.get("index_patterns", []),
+            "priority": body.get("priority") or 0,
+            "version": body.get("version"),
+            "composed_of": body.get("composed_of", []),
+            "data_stream": "data_stream" in body,
+        }
+
+    components = {}
+    if any(t["composed_of"] for t in templates.values()):
+        r = session.get(
+            f"{es_url}/_component_template",
+            params={"filter_path": "component_templates.name,"
+                                   "component_templates.component_template.version"},
+            timeout=30,
+        )
+        r.raise_for_status()
+        for entry in r.json().get("component_templates", []):
+            components[entry["name"]] = entry.get("component_template", {}).get("version")
+    return templates, components
+
+class TemplateMatcher:
+    """
+    Finds the index template an index was created from: the highest priority
+    non-data-stream template with a matching pattern. Patterns (where "*" is
+    the only wildcard, as in Elasticsearch) are keyed by their literal part
+    before the first "*", so a name is only tested against the patterns
+    filed under one of its own prefixes: one dict lookup per distinct prefix
+    length instead of every pattern of every template.
+    """
+
+    def __init__(self, templates):
+        self._by_prefix = {}
+        for name, template in templates.items():
+            if template["data_stream"]:
+                continue
+            for pattern in template["patterns"]:
+                prefix, star, rest = pattern.partition("*")
+                if not star:
+                    test = pattern.__eq__
+                elif not rest.replace("*", ""):
+                    test = None
+                else:
+                    test = re.compile(
+                        ".*".join(re.escape(part) for part in pattern.split("*")), re.S
+                    ).fullmatch
+                self._by_prefix.setdefault(prefix, []).append(
+                    (template["priority"], name, test)
+                )
+        self._lengths = sorted({len(prefix) for prefix in self._by_prefix})
+
+    def match(self, index):
+        """Name of the template matching `index`, or None."""
+        best = None
+        for length in self._lengths:
+            if length > len(index):
+                break
+            for priority, name, test in self._by_prefix.get(index[:length], ()):
+                if (best is None or priority > best[0]) and (test is None or test(index)):
+                    best = (priority, name)
+        return best[1] if best else None
+
+def template_version_key(template, components):
+    """
+    Version key of a template and its component templates, or None if any
+    of them is unversioned (its entry could not be invalidated).
+    """
+    versions = [template["version"]] + [components.get(c) for c in template["composed_of"]]
+    if any(v is None for v in versions):
+        return None
+    return json.dumps(versions)
+
+def template_mapping_filter_path(prefix):
+    """filter_path keeping only the candidate field branches of template mappings."""
+    return ",".join(
+        f"{prefix}.mappings.properties." + ".properties.".join(c.split(".")) + ".type"
+        for c in TIMESTAMP_CANDIDATES
+    )
+
+def merge_properties(target, source):
+    """Merge mapping properties recursively; later sources win, as in template composition."""
+    for field, value in source.items():
+        if field in target and "properties" in value and "properties" in target[field]:
+            merge_properties(target[field]["properties"], value["properties"])
+        else:
+            target[field] = value
+    return target
+
+def fetch_template_timestamp_fields(es_url, auth, names, templates):
+    """
+    Resolve the timestamp field of the named index templates from their
+    own and their component templates' mappings, merged in composition order.
+    Only date and date_nanos candidates count. Returns {template: ts_field or None}.
+    """
+    session = get_session(auth)
+    r = session.get(
+        f"{es_url}/_index_template/{','.join(names)}",
+        params={"filter_path": "index_templates.name," + template_mapping_filter_path(
+            "index_templates.index_template.template")},
+        timeout=30,
+    )
+    r.raise_for_status()
+    own = {
+        entry["name"]: entry["index_template"].get("template", {})
+                            .get("mappings", {}).get("properties", {})
+        for entry in r.json().get("index_templates", [])
+    }
+
+    component_names = sorted({c for name in names for c in templates[name]["composed_of"]})
+    component_props = {}
+    if component_names:
+        r = session.get(
+            f"{es_url}/_component_template/{','.join(component_names)}",
+            params={"filter_path": "component_templates.name," + template_mapping_filter_path(
+                "component_templates.component_template.template")},
+            timeout=30,
+        )
+        r.raise_for_status()
+        component_props = {
+            entry["name"]: entry["component_template"].get("template", {})
+                                .get("mappings", {}).get("properties", {})
+            for entry in r.json().get("component_templates", [])
+        }
+
+    fields = {}
+    for name in names:
+        props = {}
+        for component in templates[name]["composed_of"]:
+            merge_properties(props, json.loads(json.dumps(component_props.get(component, {}))))
+        merge_properties(props, own.get(name, {}))
+        fields[name] = next(
+            (c for c in TIMESTAMP_CANDIDATES if candidate_type(props, c) in ("date", "date_nanos")),
+            None,
+        )
+    return fields
+
+def candidate_type(props, candidate):
+    """Mapped type of a dotted candidate field in a properties tree, or None."""
+    current = {"properties": props}
+    for part in candidate.split("."):
+        current = current.get("properties", {}).get(part)
+        if current is None:
+            return None
+    return current.get("type")
+
+def template_timestamp_fields(es_url, auth, indices):
+    """
+    Timestamp fields of the regular indices whose index template maps a
+    timestamp candidate, from the TemplateCache where the template version is
+    unchanged and from one batched template lookup otherwise.
+    An index keeps its template's field only if its own mapping confirms it
+    (mappings can be changed after creation, or the template after the index).
+    Returns {index: ts_field} for the confirmed indices only; empty when
+    TEMPLATE_TS_CACHE is off or the templates cannot be read.
+    """
+    if not TEMPLATE_TS_CACHE or not indices:
+        return {}
+    try:
+        templates, components = fetch_index_templates(es_url, auth)
+        matcher = TemplateMatcher(templates)
+        by_template = {}
+        for index in indices:
+            name = matcher.match(index)
+            if name is not None:
+                by_template.setdefault(name, []).append(index)
+        if not by_template:
+            return {}
+
+        cache = TemplateCache(TEMPLATE_CACHE_PATH)
+        try:
+            cluster = url_origin(es_url)
+            fields, missing = {}, []
+            for name in by_template:
+                version_key = template_version_key(templates[name], components)
+                cached = cache.get(cluster, name, version_key) if version_key else None
+                if cached is None:
+                    missing.append(name)
+                else:
+                    fields[name] = cached or None
+            if missing:
+                fetched = fetch_template_timestamp_fields(es_url, auth, missing, templates)
+                fields.update(fetched)
+                cache.put_many(cluster, [
+                    (name, template_version_key(templates[name], components), ts_field)
+                    for name, ts_field in fetched.items()
+                    if template_version_key(templates[name], components)
+                ])
+        finally:
+            cache.close()
+
+        expected = {
+            index: fields[name]
+            for name, members in by_template.items() if fields.get(name)
+            for index in members
+        }
+        ts_fields = confirm_timestamp_fields(es_url, auth, expected) if expected else {}
+    except Exception as e:
+        print(f"      Template timestamp lookup failed, detecting per index: {e}")
+        return {}
+
+    if ts_fields:
+        served = sum(1 for name in by_template if fields.get(name))
+        print(f"      {len(ts_fields)} index/indices resolved from {served} index template(s) "
+              f"({len(by_template) - len(missing)} cached).")
+    if len(ts_fields) < len(expected):
+        print(f"      {len(expected) - len(ts_fields)} index/indices do not map their "
+              f"template's timestamp field, detecting per index.")
+    return ts_fields
+
+# ================= INGEST LEDGER =================
+def window_days(start_dt, end_dt):
+    """Calendar days (UTC dates) covered by the analysis window."""
+    days = []
+    day = start_dt.date()
+    while day <= end_dt.date():
+        days.append(day)
+        day += timedelta(days=1)
+    return days
+
+class IngestLedger:
+    """
+    SQLite ledger of per-day doc counts and byte estimates per cluster, data
+    stream or regular index (and timestamp field). Closed days are never
+    counted again.
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.days_queried = 0
+        self.days_reused = 0
+        with self._lock:
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(ingest_days)")]
+            if columns and "cluster" not in columns:
+                # Rows from before the cluster key cannot be told apart; recount them
+                self._conn.execute("DROP TABLE ingest_days")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS ingest_days (
+                    cluster TEXT NOT NULL,
+                    target TEXT NOT NULL,
+                    ts_field TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    docs INTEGER NOT NULL,
+                    est_bytes REAL NOT NULL,
+                    closed INTEGER NOT NULL,
+                    PRIMARY KEY (cluster, target, ts_field, day)
+                )
+                """
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def closed_days(self, cluster, target, ts_field, start_dt, end_dt):
+        """Set of ISO days in the window that are closed in the ledger."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT day FROM ingest_days WHERE cluster = ? AND target = ? "
+                "AND ts_field = ? AND day BETWEEN ? AND ? AND closed = 1",
+                (cluster, target, ts_field,
+                 start_dt.date().isoformat(), end_dt.date().isoformat()),
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def record(self, rows):
+        """Insert or replace (cluster, target, ts_field, day, docs, est_bytes, closed) rows."""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO ingest_days VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+
+    def window_totals(self, cluster, target, ts_field, start_dt, end_dt):
+        """Return (docs, est_bytes) summed over the window's days."""
+        with self._lock:
+            docs, est_bytes = self._conn.execute(
+                "SELECT COALESCE(SUM(docs), 0), COALESCE(SUM(est_bytes), 0) "
+                "FROM ingest_days WHERE cluster = ? AND target = ? AND ts_field = ? "
+                "AND day BETWEEN ? AND ?",
+                (cluster, target, ts_field,
+                 start_dt.date().isoformat(), end_dt.date().isoformat()),
+            ).fetchone()
+        return docs, est_bytes
+
+    def window_daily(self, cluster, target, ts_field, start_dt, end_dt):
+        """Return {"YYYY-MM-DD": docs} for the window's days."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT day, docs FROM ingest_days "
+                "WHERE cluster = ? AND target = ? AND ts_field = ? AND day BETWEEN ? AND ?",
+                (cluster, target, ts_field,
+                 start_dt.date().isoformat(), end_dt.date().isoformat()),
+            ).fetchall()
+        return dict(rows)
+
+    def update(self, es_url, auth, targets, start_dt, end_dt, batch_size=None):
+        """
+        Count the open days of every target and record them.
+        `targets` maps name -> (ts_field, avg_doc_size_bytes).
+        Returns ({name: (docs, est_bytes)} over the window, set of failed names).
+        """
+        cluster = url_origin(es_url)
+        days = window_days(start_dt, end_dt)
+        searches = {}
+        for name, (ts_field, _) in targets.items():
+            closed = self.closed_days(cluster, name, ts_field, start_dt, end_dt)
+            open_days = [d for d in days if d.isoformat() not in closed]
+            self.days_reused += len(days) - len(open_days)
+            if open_days:
+                searches[name] = (ts_field, open_days[0], open_days[-1])
+
+        daily = msearch_daily_counts(es_url, auth, {
+            name: (
+                ts_field,
+                datetime.combine(first_day, datetime.min.time(), tzinfo=timezone.utc),
+                datetime.combine(last_day, datetime.max.time(), tzinfo=timezone.utc),
+            )
+            for name, (ts_field, first_day, last_day) in searches.items()
+        }, batch_size) if searches else {}
+
+        now = datetime.now(timezone.utc)
+        grace = timedelta(hours=LEDGER_CLOSE_AFTER_HOURS)
+        rows = []
+        failed = set()
+        for name, (ts_field, first_day, last_day) in searches.items():
+            buckets = daily.get(name)
+            if buckets is None:
+                failed.add(name)
+                continue
+            avg_doc_size_bytes = targets[name][1]
+            day = first_day
+            while day <= last_day:
+                docs = buckets.get(day.isoformat(), 0)
+                day_end = datetime.combine(day + timedelta(days=1), datetime.min.time(),
+                                           tzinfo=timezone.utc)
+                closed = day_end + grace <= now
+                rows.append((cluster, name, ts_field, day.isoformat(), docs,
+                             docs * avg_doc_size_bytes, int(closed)))
+                self.days_queried += 1
+                day += timedelta(days=1)
+        if rows:
+            self.record(rows)
+
+        totals = {
+            name: self.window_totals(cluster, name, ts_field, start_dt, end_dt)
+            for name, (ts_field, _) in targets.items()
+            if name not in failed
+        }
+        return totals, failed
+
+# ================= ANALYSIS =================
+def print_progress(res):
+    """Print the progress line for one finished result."""
+    if "error" in res:
+        print(f"  [FAIL] {res['name']}: {res['error']}")
+    elif res["type"] == "data_stream":
+        print(f"  [DS]  {res['name']}")
+    else:
+        ts_info = res.get("ts_field") or "no-timestamp"
+        print(f"  [IDX] {res['name']} ({ts_info})")
+
+def run_per_index_analysis(es_url, auth, data_stream_names, regular_indices,
+                           start_dt, end_dt, stats, ds_plan=None, contained=None):
+    """Steps 4-5 with one _count request per data stream / regular index."""
+    contained = dict(contained or {})
+    store, failures = ResultStore(), []
+    set_phase("analyze data streams")
+    if data_stream_names:
+        print(f"\n[4/5] Analyzing {len(data_stream_names)} data stream(s)...")
+        with ThreadPoolExecutor(max_workers=worker_count()) as executor:
+            futures = {
+                executor.submit(process_data_stream, es_url, auth, ds, start_dt, end_dt,
+                                stats, ds_plan, contained): ds
+                for ds in data_stream_names
+            }
+            for future in as_completed(futures):
+                res = future.result()
+                if res:
+                    collect(res, store, failures)
+                    print_progress(res)
+    else:
+        print("\n[4/5] No data streams found, skipping.")
+
+    set_phase("analyze regular indices")
+    if regular_indices:
+        print(f"\n[5/5] Analyzing {len(regular_indices)} regular index/indices...")
+        ts_fields = None
+        if TIMESTAMP_DETECTION == "field_caps":
+            ts_fields = detect_timestamp_fields(es_url, auth, regular_indices)
+            if SKIP_CONTAINED_COUNTS:
+                contained.update(report_contained(es_url, auth, ts_fields, start_dt, end_dt))
+        with ThreadPoolExecutor(max_workers=worker_count()) as executor:
+            futures = {
+                executor.submit(process_regular_index, es_url, auth, idx, start_dt, end_dt,
+                                stats, ts_fields, contained): idx
+                for idx in regular_indices
+            }
+            for future in as_completed(futures):
+                res = future.result()
+                if res:
+                    collect(res, store, failures)
+                    print_progress(res)
+    else:
+        print("\n[5/5] No regular indices found, skipping.")
+
+    failures.sort(key=lambda x: x["name"])
+    return store, failures
+
+def report_backing_plan(es_url, auth, data_streams, start_dt, end_dt, stats, cache=None):
+    """
+    Run plan_backing_indices and print how many generations were skipped.
+    Returns (plan, contained), or (None, {}) if planning failed.
+    """
+    try:
+        ds_plan, pruned, contained = plan_backing_indices(
+            es_url, auth, data_streams, start_dt, end_dt, stats, cache
+        )
+    except Exception as e:
+        print(f"      Backing index planning failed, counting whole streams: {e}")
+        return None, {}
+    total = sum(len(indices) for indices in data_streams.backing.values())
+    print(f"      Skipping {pruned} of {total} backing index/indices "
+          f"outside the window.")
+    if not SKIP_CONTAINED_COUNTS:
+        contained = {}
+    elif contained:
+        print(f"      {len(contained)} backing index/indices lie fully inside "
+              f"the window, not counted.")
+    return ds_plan, contained
+
+def report_contained(es_url, auth, ts_fields, start_dt, end_dt):
+    """Run plan_contained_indices for the regular indices and print how many were found."""
+    contained = plan_contained_indices(es_url, auth, ts_fields, start_dt, end_dt)
+    if contained:
+        print(f"      {len(contained)} regular index/indices lie fully inside the window, "
+              f"not counted.")
+    return contained
+
+def run_batched_analysis(es_url, auth, data_stream_names, regular_indices,
+                         start_dt, end_dt, stats, mode, cache=None, index_meta=None,
+                         ledger=None, ds_plan=None, contained=None):
+    """Steps 4-5 with timestamp detection up front and batched range counts."""
+    ts_fields = {}
+    contained = dict(contained or {})
+    set_phase("timestamp detection")
+    if regular_indices:
+        print(f"\n[4/5] Detecting timestamp fields for {len(regular_indices)} regular index/indices...")
+        ts_fields = detect_timestamp_fields(es_url, auth, regular_indices)
+        if SKIP_CONTAINED_COUNTS:
+            contained.update(report_contained(es_url, auth, ts_fields, start_dt, end_dt))
+    else:
+        print("\n[4/5] No regular indices found, skipping timestamp detection.")
+
+    targets = [(ds, "data_stream", "@timestamp") for ds in sorted(data_stream_names)]
+    targets += [(idx, "regular", ts_fields.get(idx)) for idx in regular_indices]
+    if not targets:
+        print("\n[5/5] Nothing to analyze, skipping.")
+        return ResultStore(), []
+
+    set_phase("range counts")
+    if mode == "terms":
+        groups = len({ts_field for _, _, ts_field in targets})
+        print(f"\n[5/5] Counting {len(targets)} target(s) via terms aggregation "
+              f"({groups} timestamp field group(s))...")
+    else:
+        print(f"\n[5/5] Counting {len(targets)} target(s) via _msearch "
+              f"(batch size {MSEARCH_BATCH_SIZE})...")
+    results = analyze_batched(
+        es_url, auth, targets, start_dt, end_dt, stats,
+        mode=mode, cache=cache, index_meta=index_meta, ledger=ledger, ds_plan=ds_plan,
+        contained=contained, data_streams=data_stream_names,
+    )
+    for res in results:
+        print_progress(res)
+
+    return split_results(results)
+
+def run_threaded_engine(es_url, auth, filter_pattern, start_dt, end_dt):
+    """Discovery and analysis on the shared session with worker_count() threads."""
+    if ADAPTIVE_CONCURRENCY and ADAPTIVE_SEED_FROM_NODES:
+        seed = seed_concurrency(es_url, auth)
+        if seed:
+            print(f"\n      Adaptive concurrency seeded from {seed} idle search thread(s).")
+
+    # Discovery errors are reported as failures so the exit code reflects them
+    discovery_failures = []
+
+    if DISCOVERY == "resolve":
+        # ---- Step 1-2: Data Streams and Regular Indices in one call ----
+        set_phase("discover (_resolve/index)")
+        print("\n[1/5] Resolving data streams and regular indices...")
+        started = time.perf_counter()
+        try:
+            data_streams, regular_indices = resolve_indices(es_url, auth, filter_pattern)
+            print(f"      Found {len(data_streams)} data stream(s) "
+                  f"in {time.perf_counter() - started:.2f}s.")
+        except Exception as e:
+            print(f"      Failed to resolve indices: {e}")
+            discovery_failures.append(failure("_resolve/index", "cluster", str(e)))
+            data_streams, regular_indices = DataStreams(), []
+        print(f"[2/5] Found {len(regular_indices)} regular index/indices.")
+    else:
+        # ---- Step 1: Fetch Data Streams ----
+        set_phase("discover data streams")
+        print("\n[1/5] Fetching data streams...")
+        started = time.perf_counter()
+        try:
+            data_streams = get_data_streams(es_url, auth)
+            print(f"      Found {len(data_streams)} data stream(s) "
+                  f"in {time.perf_counter() - started:.2f}s.")
+        except Exception as e:
+            print(f"      Failed to fetch data streams: {e}")
+            discovery_failures.append(failure("_data_stream", "cluster", str(e)))
+            data_streams = DataStreams()
+
+        # ---- Step 2: Fetch Regular Indices ----
+        set_phase("discover regular indices")
+        print("[2/5] Fetching regular indices...")
+        started = time.perf_counter()
+        try:
+            regular_indices = get_regular_indices(es_url, auth, data_streams, filter_pattern)
+            print(f"      Found {len(regular_indices)} regular index/indices "
+                  f"in {time.perf_counter() - started:.2f}s.")
+        except Exception as e:
+            print(f"      Failed to fetch regular indices: {e}")
+            discovery_failures.append(failure("_cat/indices", "cluster", str(e)))
+            regular_indices = []
+
+    # ---- Step 3: Prefetch Stats ----
+    set_phase("prefetch stats")
+    print("[3/5] Prefetching primary stats...")
+    try:
+        stats = fetch_bulk_stats(es_url, auth, data_streams)
+        print(f"      Loaded stats for {len(stats)} index/data stream(s).")
+    except Exception as e:
+        print(f"      Bulk stats failed, falling back to per-index stats: {e}")
+        stats = {}
+
+    cache, index_meta = open_stats_cache(es_url, auth, data_streams)
+    ledger = IngestLedger(LEDGER_PATH) if INCREMENTAL_LEDGER else None
+    try:
+        ds_plan, contained = None, {}
+        if DS_PRUNE_GENERATIONS and data_streams:
+            ds_plan, contained = report_backing_plan(
+                es_url, auth, data_streams, start_dt, end_dt, stats, cache
+            )
+
+        # ---- Step 4/5: Analyze ----
+        if COUNT_MODE in ("msearch", "terms"):
+            store, failures = run_batched_analysis(
+                es_url, auth, data_streams, regular_indices, start_dt, end_dt, stats,
+                COUNT_MODE, cache, index_meta, ledger, ds_plan, contained,
+            )
+        else:
+            store, failures = run_per_index_analysis(
+                es_url, auth, data_streams, regular_indices, start_dt, end_dt, stats,
+                ds_plan, contained,
+            )
+        for res in discovery_failures:
+            emit_result(res)
+        return store, discovery_failures + failures
+    finally:
+        if cache is not None:
+            if cache.hits or cache.misses:
+                print(f"      Stats cache: {cache.hits} index/indices reused, "
+                      f"{cache.misses} queried.")
+            cache.close()
+        if ledger is not None:
+            print(f"      Ingest ledger: {ledger.days_reused} day(s) reused, "
+                  f"{ledger.days_queried} day(s) counted.")
+            ledger.close()
+
+# ================= PEAK HOUR =================
+class QuantileSketch:
+    """
+    Bounded-memory quantile sketch over non-negative values (DDSketch style).
+    Values fall into logarithmic bins whose width keeps every quantile within
+    `relative_accuracy` of the true value; past `max_bins` the lowest bins are
+    merged, which only degrades the lowest quantiles.
+    """
+
+    def __init__(self, relative_accuracy=0.01, max_bins=2048):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.max_bins = max_bins
+        self.bins = {}
+        self.zeros = 0
+        self.count = 0
+        self.max = 0.0
+
+    def add(self, value, count=1):
+        if count <= 0:
+            return
+        self.count += count
+        if value <= 0:
+            self.zeros += count
+            return
+        self.max = max(self.max, value)
+        key = math.ceil(math.log(value) / self._log_gamma)
+        self.bins[key] = self.bins.get(key, 0) + count
+        if len(self.bins) > self.max_bins:
+            lowest = sorted(self.bins)[:len(self.bins) - self.max_bins + 1]
+            merged = sum(self.bins.pop(k) for k in lowest)
+            self.bins[lowest[-1]] = merged
+
+    def quantile(self, q):
+        """Value at quantile q (0..1), or 0.0 for an empty sketch."""
+        if not self.count:
+            return 0.0
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if rank < seen:
+                # Midpoint of the bin (gamma^(key-1), gamma^key], clamped to the max
+                return min(2 * self.gamma ** key / (self.gamma + 1), self.max)
+        return self.max
+
+def msearch_hourly_buckets(es_url, auth, searches, batch_size=None):
+    """
+    Hourly document counts through _msearch with a fixed 1h date_histogram.
+    `searches` maps name -> (ts_field, start_dt, end_dt). Only non-empty hours
+    are returned. Returns {name: [(hour_epoch_ms, count)]}, None on failure.
+    """
+    bodies = {
+        name: {
+            "size": 0,
+            "track_total_hits": False,
+            "query": range_query(ts_field, start_dt, end_dt),
+            "aggs": {
+                "hours": {
+                    "date_histogram": {
+                        "field": ts_field,
+                        "fixed_interval": "1h",
+                        "min_doc_count": 1,
+                    }
+                }
+            },
+        }
+        for name, (ts_field, start_dt, end_dt) in searches.items()
+    }
+    responses = run_msearch(
+        es_url, auth, bodies,
+        "responses.aggregations.hours.buckets.key,"
+        "responses.aggregations.hours.buckets.doc_count",
+        batch_size,
+    )
+
+    hourly = {}
+    for name, resp in responses.items():
+        if resp is None:
+            hourly[name] = None
+            continue
+        buckets = resp.get("aggregations", {}).get("hours", {}).get("buckets", [])
+        hourly[name] = [(int(b["key"]), b["doc_count"]) for b in buckets]
+    return hourly
+
+def format_hour(epoch_ms):
+    """Hour bucket key as 'YYYY-MM-DD HH:00' (UTC), or '-' without one."""
+    if epoch_ms is None:
+        return "-"
+    return datetime.fromtimestamp(epoch_ms / 1000, timezone.utc).strftime("%Y-%m-%d %H:00")
+
+def measure_peak_hours(es_url, auth, store, start_dt, end_dt, batch_size=None):
+    """
+    Hourly ingest on top of a finished ResultStore. Each timestamped row is
+    searched with hourly buckets; bucket counts are weighted by the result's
+    bytes per document, summarized in a per-target sketch and merged into a
+    cluster-wide hourly series. Per-target hours are dropped after each
+    batch, so memory stays bounded by the window length and the sketches.
+    Sets peak_hour_gb, p99_hour_gb and peak_hour on every measured row.
+    Returns ({hour_epoch_ms: GB} cluster-wide series, list of names that failed).
+    """
+    batch_size = batch_size or PEAK_HOUR_BATCH_SIZE
+    window_hours = count_window_hours(start_dt, end_dt)
+    targets = {
+        store.get(row, "name"): row for row in store.rows()
+        if store.get(row, "ts_field") and store.get(row, "range_docs")
+    }
+    names = list(targets)
+    group = batch_size * worker_count()
+
+    cluster = {}
+    failed = []
+    for i in range(0, len(names), group):
+        chunk = names[i:i + group]
+        hourly = msearch_hourly_buckets(es_url, auth, {
+            name: (store.get(targets[name], "ts_field"), start_dt, end_dt) for name in chunk
+        }, batch_size)
+        for name in chunk:
+            buckets = hourly.get(name)
+            if buckets is None:
+                failed.append(name)
+                continue
+            row = targets[name]
+            gb_per_doc = store.get(row, "est_size_gb") / store.get(row, "range_docs")
+            sketch = QuantileSketch(PEAK_HOUR_SKETCH_ACCURACY, PEAK_HOUR_SKETCH_BINS)
+            sketch.add(0.0, window_hours - len(buckets))
+            peak_key, peak_gb = None, 0.0
+            for key, count in buckets:
+                gb = count * gb_per_doc
+                sketch.add(gb)
+                cluster[key] = cluster.get(key, 0.0) + gb
+                if gb > peak_gb:
+                    peak_key, peak_gb = key, gb
+            store.set(row, "peak_hour_gb", peak_gb)
+            store.set(row, "p99_hour_gb", sketch.quantile(0.99))
+            store.set(row, "peak_hour", format_hour(peak_key))
+    return cluster, failed
+
+def count_window_hours(start_dt, end_dt):
+    """Number of hour buckets in the analysis window."""
+    return max(math.ceil((end_dt - start_dt).total_seconds() / 3600), 1)
+
+def hourly_profile(series, start_dt, end_dt):
+    """
+    Peak and p99 GB/hour of an hourly {hour_epoch_ms: GB} series; hours
+    missing from the series count as zero. Returns None for an empty series.
+    """
+    if not series:
+        return None
+    sketch = QuantileSketch(PEAK_HOUR_SKETCH_ACCURACY, PEAK_HOUR_SKETCH_BINS)
+    sketch.add(0.0, count_window_hours(start_dt, end_dt) - len(series))
+    for gb in series.values():
+        sketch.add(gb)
+    peak_key = max(series, key=series.get)
+    return {
+        "peak_hour_gb": series[peak_key],
+        "p99_hour_gb": sketch.quantile(0.99),
+        "peak_hour": format_hour(peak_key),
+    }
+
+# ================= DOC SIZE SAMPLING =================
+def sample_size(range_docs):
+    """Number of documents to fetch for a source sample of a target."""
+    wanted = math.ceil(range_docs * DOC_SIZE_SAMPLE_PROBABILITY)
+    return min(max(wanted, DOC_SIZE_SAMPLE_MIN), DOC_SIZE_SAMPLE_MAX, range_docs)
+
+def sample_body(ts_field, range_docs, start_dt, end_dt):
+    """
+    Search body sampling window documents. With DOC_SIZE_FIELD a random_sampler
+    aggregation computes extended stats of that field server-side; otherwise
+    a seeded random_score query returns the _source of sample_size() docs.
+    """
+    query = range_query(ts_field, start_dt, end_dt)
+    if DOC_SIZE_FIELD:
+        # random_sampler accepts probabilities up to 0.5, or exactly 1
+        probability = DOC_SIZE_SAMPLE_PROBABILITY
+        if probability > 0.5:
+            probability = 1
+        return {
+            "size": 0,
+            "track_total_hits": False,
+            "query": query,
+            "aggs": {
+                "sample": {
+                    "random_sampler": {
+                        "probability": probability,
+                        "seed": DOC_SIZE_SAMPLE_SEED,
+                    },
+                    "aggs": {"doc_size": {"extended_stats": {"field": DOC_SIZE_FIELD}}},
+                }
+            },
+        }
+    return {
+        "size": sample_size(range_docs),
+        "track_total_hits": False,
+        "query": {
+            "function_score": {
+                "query": query,
+                "random_score": {"seed": DOC_SIZE_SAMPLE_SEED, "field": "_seq_no"},
+                "boost_mode": "replace",
+            }
+        },
+    }
+
+def parse_sample(resp):
+    """
+    Return (sampled docs, mean bytes, std deviation) from a sample response,
+    or None when nothing was sampled.
+    """
+    if DOC_SIZE_FIELD:
+        stats = resp.get("aggregations", {}).get("sample", {}).get("doc_size", {})
+        if not stats.get("count") or stats.get("avg") is None:
+            return None
+        # extended_stats runs on the sampled docs only, so its count is n
+        return int(stats["count"]), stats["avg"], stats.get("std_deviation") or 0.0
+
+    sizes = [
+        len(json.dumps(hit.get("_source", {}), separators=(",", ":")).encode())
+        for hit in resp.get("hits", {}).get("hits", [])
+    ]
+    if not sizes:
+        return None
+    mean = sum(sizes) / len(sizes)
+    variance = sum((x - mean) ** 2 for x in sizes) / max(len(sizes) - 1, 1)
+    return len(sizes), mean, math.sqrt(variance)
+
+def sample_doc_sizes(es_url, auth, store, start_dt, end_dt, batch_size=None):
+    """
+    Estimate each row's window size from a document sample, batched
+    through _msearch. Sets sample_docs, sampled_doc_bytes, sampled_size_gb and
+    sampled_size_ci_gb (95% half-width) on every sampled row.
+    Returns the names whose sample search failed or came back empty.
+    """
+    batch_size = batch_size or DOC_SIZE_SAMPLE_BATCH_SIZE
+    targets = {store.get(row, "name"): row for row in store.rows() if store.get(row, "range_docs")}
+    if DOC_SIZE_FIELD:
+        filter_path = "responses.aggregations.sample.doc_size"
+    else:
+        filter_path = "responses.hits.hits._source"
+
+    responses = run_msearch(es_url, auth, {
+        name: sample_body(
+            store.get(row, "ts_field"), store.get(row, "range_docs"), start_dt, end_dt
+        )
+        for name, row in targets.items()
+    }, filter_path, batch_size)
+
+    failed = []
+    for name, row in targets.items():
+        range_docs = store.get(row, "range_docs")
+        resp = responses.get(name)
+        sample = parse_sample(resp) if resp is not None else None
+        if sample is None:
+            failed.append(name)
+            continue
+        n, mean, std = sample
+        half_width = 1.96 * std / math.sqrt(n)
+        store.set(row, "sample_docs", n)
+        store.set(row, "sampled_doc_bytes", mean)
+        store.set(row, "sampled_size_gb", range_docs * mean / (1024 ** 3))
+        store.set(row, "sampled_size_ci_gb", range_docs * half_width / (1024 ** 3))
+    return failed
+
+# ================= ASYNC ENGINE =================
+async def _async_request(client, sem, method, url, **kwargs):
+    """
+    Send one request under the in-flight cap (and the RequestBudget in
+    multi-cluster runs), with the same retry, backoff and circuit-breaker
+    behaviour as EsAdapter for the threaded engine.
+    """
+    import httpx
+
+    policy = get_retry_policy(url)
+    budget = _request_budget
+    attempt = 0
+    while True:
+        pause = policy.pause_remaining()
+        if pause:
+            await asyncio.sleep(pause)
+
+        r, error = None, None
+        async with sem:
+            held = await budget.acquire_async(url) if budget else None
+            try:
+                r = await client.request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                error = e
+            finally:
+                if held:
+                    budget.release(held)
+
+        if error is not None:
+            overloaded = isinstance(error, httpx.TimeoutException)
+        else:
+            overloaded = is_overloaded(r.status_code, r.content)
+            if DEBUG_WIRE_STATS:
+                add_wire_bytes(url, len(r.request.content), r.num_bytes_downloaded,
+                               len(r.content))
+        policy.record(overloaded)
+
+        attempt += 1
+        retryable = error is not None or r.status_code in RETRY_STATUSES
+        if not retryable or attempt >= policy.max_attempts or not policy.take_retry():
+            if error is not None:
+                raise error
+            return r
+
+        retry_after = r.headers.get("Retry-After") if r is not None else None
+        await asyncio.sleep(policy.backoff(attempt, retry_after))
+
+async def _async_json(client, sem, method, url, **kwargs):
+    """Return parsed JSON, or None on a non-200 response."""
+    r = await _async_request(client, sem, method, url, **kwargs)
+    if r.status_code != 200:
+        return None
+    return r.json()
+
+async def _async_require_json(client, sem, method, url, **kwargs):
+    """Return parsed JSON, raising on a non-200 response."""
+    r = await _async_request(client, sem, method, url, **kwargs)
     r.raise_for_status()
-    return {ds["name"] for ds in r.json()["data_streams"]}
+    return r.json()
 
-def process_data_stream(es_url, auth, ds_name, start_dt, end_dt):
+async def _async_primary_docs(client, sem, es_url, names, stats):
     """
-    Analyze a data stream using the aggregate primary shards method.
-    More accurate because avg_doc_size is calculated across all backing indices.
+    Async counterpart of sum_primary_docs_stats: prefetched stats where
+    available, one _stats call per chunk of the rest. None on failure.
     """
-    session = requests.Session()
-    session.auth = auth
-    session.verify = False
-
-    try:
-        # Stats aggregated across all backing indices
-        r_stats = session.get(f"{es_url}/{ds_name}/_stats", timeout=30)
-        if r_stats.status_code != 200:
+    total_docs, total_bytes = 0, 0
+    missing = []
+    for name in names:
+        if name in stats:
+            total_docs += stats[name][0]
+            total_bytes += stats[name][1]
+        else:
+            missing.append(name)
+    for chunk in chunk_index_names(missing, TERMS_MAX_URL_CHARS):
+        data = await _async_json(
+            client, sem, "GET", f"{es_url}/{','.join(chunk)}/_stats/docs",
+            params={"filter_path": "_all.primaries.docs"},
+        )
+        if data is None:
             return None
+        docs, size = parse_primary_docs(data)
+        total_docs += docs
+        total_bytes += size
+    return total_docs, total_bytes
 
-        primaries = r_stats.json()["_all"]["primaries"]
-        total_bytes_primary = primaries["docs"].get("total_size_in_bytes", 0)
-        total_docs_primary = primaries["docs"].get("count", 0)
+async def async_process_target(client, sem, es_url, name, kind, start_dt, end_dt,
+                               stats, ts_fields, ds_plan=None, contained=None):
+    """
+    Async counterpart of process_data_stream/process_regular_index.
+    Applies the same backing index plan and contained counts, so the
+    numbers match the threaded engine.
+    Returns the same result or failure dict, or None if the target is empty.
+    """
+    try:
+        units = [name]
+        if kind == "data_stream" and ds_plan is not None and name in ds_plan:
+            units = ds_plan[name]
+            if not units:
+                return None
+        primary = await _async_primary_docs(client, sem, es_url, units, stats)
+        if primary is None:
+            return failure(name, kind, "_stats request failed")
 
+        total_docs_primary, total_bytes_primary = primary
         if total_docs_primary == 0:
             return None
 
         avg_doc_size_bytes = total_bytes_primary / total_docs_primary
 
-        # Count documents within the time range
-        query = {
-            "query": {
-                "range": {
-                    "@timestamp": {
-                        "gte": start_dt.isoformat(),
-                        "lte": end_dt.isoformat()
-                    }
-                }
-            }
-        }
-        r_count = session.post(f"{es_url}/{ds_name}/_count", json=query, timeout=30)
-        if r_count.status_code != 200:
-            return None
+        if kind == "data_stream":
+            ts_field = "@timestamp"
+        elif name in ts_fields:
+            ts_field = ts_fields[name]
+        else:
+            mapping = await _async_json(
+                client, sem, "GET", f"{es_url}/{name}/_mapping",
+                params={"filter_path": mapping_filter_path()},
+            )
+            ts_field = find_timestamp_field(mapping) if mapping else None
+
+        known = contained_units(units, contained, ts_field)
+        range_doc_count = sum(known.values())
+        pending = [unit for unit in units if unit not in known]
+        for chunk in chunk_index_names(pending, TERMS_MAX_URL_CHARS):
+            r_count = await _async_request(
+                client, sem, "POST", f"{es_url}/{','.join(chunk)}/_count",
+                params={"filter_path": "count"},
+                json={"query": range_query(ts_field, start_dt, end_dt)},
+            )
+            if r_count.status_code != 200:
+                return failure(name, kind, f"_count returned HTTP {r_count.status_code}")
+            range_doc_count += r_count.json().get("count", 0)
 
-        range_doc_count = r_count.json().get("count", 0)
         if range_doc_count == 0:
             return None
 
-        est_range_size_gb = (range_doc_count * avg_doc_size_bytes) / (1024 ** 3)
-        delta = end_dt - start_dt
-        days_diff = max(delta.days + (delta.seconds / 86400), 1)
-        ingest_per_day_gb = est_range_size_gb / days_diff
-
-        return {
-            "name": ds_name,
-            "type": "data_stream",
-            "range_docs": range_doc_count,
-            "est_size_gb": est_range_size_gb,
-            "ingest_rate_gb": ingest_per_day_gb,
-            "ts_field": "@timestamp",
-        }
+        note = count_note(ts_field) if kind == "regular" else None
+        return build_result(
+            name, kind, range_doc_count, avg_doc_size_bytes,
+            start_dt, end_dt, ts_field, note=note,
+        )
 
-    except Exception:
-        return None
+    except Exception as e:
+        return failure(name, kind, str(e))
 
-# ================= ELASTIC: REGULAR INDEX =================
-def get_regular_indices(es_url, auth, data_stream_names, filter_pattern=None):
+async def async_analyze(es_url, auth, filter_pattern, start_dt, end_dt):
     """
-    Retrieve all regular indices (not data streams, not restored copies).
-    Backing indices from data streams (format .ds-*) are also excluded
-    since they are already counted via the data stream method.
+    Discovery and analysis on one asyncio event loop.
+    Up to ASYNC_MAX_IN_FLIGHT requests run concurrently over a shared httpx client.
     """
-    pattern = filter_pattern if filter_pattern else "*"
-    url = f"{es_url}/_cat/indices/{pattern}?format=json&h=index,status"
+    try:
+        import httpx
+    except ImportError:
+        raise SystemExit("The async engine requires httpx: pip install httpx")
 
-    r = requests.get(url, auth=auth, verify=False, timeout=30)
-    r.raise_for_status()
+    limits = httpx.Limits(
+        max_connections=ASYNC_MAX_IN_FLIGHT,
+        max_keepalive_connections=ASYNC_MAX_IN_FLIGHT,
+    )
+    client = httpx.AsyncClient(
+        auth=(auth.username, auth.password),
+        verify=False,
+        headers={"Accept-Encoding": "gzip"},
+        limits=limits,
+        timeout=30,
+    )
+    sem = asyncio.Semaphore(ASYNC_MAX_IN_FLIGHT)
 
-    # Build backing index prefixes from known data streams
-    backing_index_prefixes = tuple(f".ds-{ds}-" for ds in data_stream_names)
+    store, failures = ResultStore(), []
+    async with client:
+        # ---- Step 1: Discovery (data streams, indices and stats together) ----
+        set_phase("discovery")
+        print("\n[1/3] Discovering data streams, regular indices and stats...")
+        if DISCOVERY == "resolve":
+            discovery = [_async_require_json(
+                client, sem, "GET",
+                f"{es_url}/_resolve/index/{cat_indices_expression(filter_pattern)}",
+                params={"expand_wildcards": "open"},
+            )]
+        else:
+            discovery = [
+                _async_require_json(
+                    client, sem, "GET", f"{es_url}/_data_stream",
+                    params={"filter_path": DATA_STREAM_FILTER},
+                ),
+                _async_require_json(
+                    client, sem, "GET",
+                    f"{es_url}/_cat/indices/{cat_indices_expression(filter_pattern)}",
+                    params=cat_indices_params(),
+                ),
+            ]
+        started = time.perf_counter()
+        *discovered, stats_data = await asyncio.gather(
+            *discovery,
+            _async_require_json(
+                client, sem, "GET", f"{es_url}/*/_stats/docs",
+                params={
+                    "level": "indices",
+                    "expand_wildcards": "open,hidden",
+                    "filter_path": "indices.*.primaries.docs",
+                },
+                timeout=60,
+            ),
+            return_exceptions=True,
+        )
+        print(f"      Discovery took {time.perf_counter() - started:.2f}s.")
 
-    regular = []
-    for item in r.json():
-        name = item.get("index", "")
-        status = item.get("status", "")
+        if DISCOVERY == "resolve":
+            resolved = discovered[0]
+            if isinstance(resolved, Exception):
+                print(f"      Failed to resolve indices: {resolved}")
+                collect(failure("_resolve/index", "cluster", str(resolved)), store, failures)
+                data_streams, regular_indices = DataStreams(), []
+            else:
+                data_streams, regular_indices = parse_resolved_indices(resolved)
+            print(f"      Found {len(data_streams)} data stream(s).")
+        else:
+            ds_data, cat_data = discovered
+            if isinstance(ds_data, Exception):
+                print(f"      Failed to fetch data streams: {ds_data}")
+                collect(failure("_data_stream", "cluster", str(ds_data)), store, failures)
+                data_streams = DataStreams()
+            else:
+                data_streams = parse_data_streams(ds_data)
+            print(f"      Found {len(data_streams)} data stream(s).")
 
-        # Skip closed indices (cannot be queried)
-        if status == "close":
-            continue
+            if isinstance(cat_data, Exception):
+                print(f"      Failed to fetch regular indices: {cat_data}")
+                collect(failure("_cat/indices", "cluster", str(cat_data)), store, failures)
+                regular_indices = []
+            else:
+                regular_indices = filter_regular_indices(cat_data, data_streams)
+        print(f"      Found {len(regular_indices)} regular index/indices.")
 
-        # Skip system & restored prefixes
-        if any(name.startswith(p) for p in EXCLUDE_PREFIXES):
-            continue
+        if isinstance(stats_data, Exception):
+            print(f"      Bulk stats failed, falling back to per-index stats: {stats_data}")
+            stats = {}
+        else:
+            stats = add_data_stream_totals(parse_index_stats(stats_data), data_streams)
 
-        # Skip backing indices belonging to data streams
-        if any(name.startswith(p) for p in backing_index_prefixes):
-            continue
+        ds_plan, contained = None, {}
+        if DS_PRUNE_GENERATIONS and data_streams:
+            ds_plan, contained = await asyncio.get_running_loop().run_in_executor(
+                None, report_backing_plan, es_url, auth, data_streams, start_dt, end_dt, stats
+            )
 
-        # Skip if the name itself is a data stream (already handled)
-        if name in data_stream_names:
-            continue
+        # ---- Step 2: Timestamp detection ----
+        set_phase("timestamp detection")
+        ts_fields = {}
+        if regular_indices and TEMPLATE_TS_CACHE:
+            print(f"\n[2/3] Detecting timestamp fields for {len(regular_indices)} regular index/indices...")
+            ts_fields = await asyncio.get_running_loop().run_in_executor(
+                None, template_timestamp_fields, es_url, auth, regular_indices
+            )
+        pending = [idx for idx in regular_indices if idx not in ts_fields]
+        if pending and TIMESTAMP_DETECTION == "field_caps":
+            if not TEMPLATE_TS_CACHE:
+                print(f"\n[2/3] Detecting timestamp fields for {len(regular_indices)} regular index/indices...")
+            try:
+                for chunk in chunk_index_names(pending, TERMS_MAX_URL_CHARS):
+                    data = await _async_require_json(
+                        client, sem, "GET", f"{es_url}/{','.join(chunk)}/_field_caps",
+                        params=field_caps_params(), timeout=60,
+                    )
+                    detected = parse_field_caps(data, chunk)
+                    ts_fields.update({idx: detected.get(idx) for idx in chunk})
+            except Exception as e:
+                print(f"      _field_caps detection failed, reading mappings instead: {e}")
+                ts_fields = {idx: f for idx, f in ts_fields.items() if idx not in pending}
+        elif not regular_indices or not TEMPLATE_TS_CACHE:
+            print("\n[2/3] Timestamp fields will be read from each mapping.")
+        if SKIP_CONTAINED_COUNTS and ts_fields:
+            contained.update(await asyncio.get_running_loop().run_in_executor(
+                None, report_contained, es_url, auth, ts_fields, start_dt, end_dt
+            ))
 
-        regular.append(name)
+        # ---- Step 3: Analysis ----
+        set_phase("analysis")
+        targets = [(ds, "data_stream") for ds in data_streams]
+        targets += [(idx, "regular") for idx in regular_indices]
+        print(f"\n[3/3] Analyzing {len(targets)} target(s) "
+              f"(up to {ASYNC_MAX_IN_FLIGHT} requests in flight)...")
 
-    return sorted(regular)
+        tasks = [
+            asyncio.ensure_future(async_process_target(
+                client, sem, es_url, name, kind, start_dt, end_dt, stats, ts_fields,
+                ds_plan, contained,
+            ))
+            for name, kind in targets
+        ]
 
+        for future in asyncio.as_completed(tasks):
+            res = await future
+            if res:
+                print_progress(res)
+                collect(res, store, failures)
 
-def detect_timestamp_field(session, es_url, index):
+    failures.sort(key=lambda x: x["name"])
+    return store, failures
+
+def async_ignored_settings():
+    """Enabled settings that only the threaded engine implements."""
+    ignored = [name for name, enabled in (
+        ("STATS_CACHE", STATS_CACHE),
+        ("INCREMENTAL_LEDGER", INCREMENTAL_LEDGER),
+        ("DAILY_SERIES", DAILY_SERIES),
+    ) if enabled]
+    if COUNT_MODE != "per_index":
+        ignored.append(f'COUNT_MODE = "{COUNT_MODE}"')
+    return ignored
+
+def run_async_engine(es_url, auth, filter_pattern, start_dt, end_dt):
+    """Run the asyncio engine to completion and return (ResultStore, failures)."""
+    return asyncio.run(async_analyze(es_url, auth, filter_pattern, start_dt, end_dt))
+
+# ================= FLEET =================
+def load_clusters(path):
     """
-    Detect the available timestamp field from the index mapping.
-    Priority: @timestamp -> timestamp -> event.created -> time -> date
-    Returns None if no timestamp field is found.
+    Read cluster definitions from a JSON file: a list of objects with name,
+    url, username and password (or password_env naming an environment
+    variable), plus optional pattern and max_in_flight.
+    Returns the definitions with "auth" resolved; raises ValueError if invalid.
     """
-    candidates = ["@timestamp", "timestamp", "event.created", "time", "date"]
+    with open(path) as f:
+        entries = json.load(f)
+    if not isinstance(entries, list) or not entries:
+        raise ValueError(f"{path}: expected a non-empty list of clusters")
 
-    try:
-        r = session.get(f"{es_url}/{index}/_mapping", timeout=15)
-        if r.status_code != 200:
-            return None
+    clusters = []
+    for i, entry in enumerate(entries, 1):
+        missing = [key for key in ("name", "url", "username") if not entry.get(key)]
+        if missing:
+            raise ValueError(f"{path}: cluster #{i} is missing {', '.join(missing)}")
+        password = entry.get("password")
+        if password is None and entry.get("password_env"):
+            password = os.environ.get(entry["password_env"])
+            if password is None:
+                raise ValueError(f"{path}: {entry['password_env']} is not set "
+                                 f"for cluster {entry['name']}")
+        if password is None:
+            raise ValueError(f"{path}: cluster {entry['name']} has neither password "
+                             f"nor password_env")
+        clusters.append({
+            "name": entry["name"],
+            "url": entry["url"].strip().rstrip("/"),
+            "auth": HTTPBasicAuth(entry["username"], password),
+            "pattern": entry.get("pattern") or None,
+            "max_in_flight": int(entry.get("max_in_flight") or FLEET_CLUSTER_MAX_IN_FLIGHT),
+        })
+    if len({c["name"] for c in clusters}) != len(clusters):
+        raise ValueError(f"{path}: cluster names must be unique")
+    return clusters
 
-        all_props = {}
-        for idx_data in r.json().values():
-            props = idx_data.get("mappings", {}).get("properties", {})
-            all_props.update(props)
-
-        for candidate in candidates:
-            parts = candidate.split(".")
-            current = all_props
-            found = True
-            for part in parts:
-                if part in current:
-                    current = current[part].get("properties", current[part])
-                else:
-                    found = False
-                    break
-            if found:
-                return candidate
+class PrefixedOutput:
+    """
+    stdout wrapper for parallel cluster runs: whole lines written by a thread
+    that called set_prefix() are tagged with its cluster name, so progress
+    from several clusters stays readable when interleaved.
+    """
 
-    except Exception:
-        pass
+    def __init__(self, stream):
+        self._stream = stream
+        self._local = threading.local()
+        self._lock = threading.Lock()
 
-    return None
+    def set_prefix(self, prefix):
+        self._local.prefix = prefix
+        self._local.pending = ""
+
+    def clear_prefix(self):
+        """Write out a trailing partial line and stop tagging this thread's output."""
+        if getattr(self._local, "pending", ""):
+            self.write("\n")
+        self._local.prefix = None
 
+    def write(self, text):
+        prefix = getattr(self._local, "prefix", None)
+        if prefix is None:
+            with self._lock:
+                return self._stream.write(text)
+        lines = (self._local.pending + text).split("\n")
+        self._local.pending = lines.pop()
+        with self._lock:
+            for line in lines:
+                self._stream.write(f"{prefix}{line}\n" if line else "\n")
+        return len(text)
 
-def process_regular_index(es_url, auth, index_name, start_dt, end_dt):
+    def flush(self):
+        with self._lock:
+            self._stream.flush()
+
+def analyze_cluster(es_url, auth, filter_pattern, start_dt, end_dt, engine="threads",
+                    peak_hour=False, cluster=None):
     """
-    Analyze a regular index with automatic timestamp field detection.
-    Falls back to counting all documents if no timestamp field is found.
+    Run one engine on one cluster, then the optional post passes (hourly
+    buckets, doc size sampling). Returns (ResultStore, failures, hourly
+    series or None).
+    With result sinks installed, rows are written as they are collected, or
+    after the post passes when those will add fields to them.
+    """
+    deferred = peak_hour or DOC_SIZE_SAMPLING
+    if _result_sinks is not None:
+        _result_sinks.bind(cluster, deferred)
+    set_phase_cluster(es_url)
+
+    if engine == "async":
+        store, failures = run_async_engine(es_url, auth, filter_pattern, start_dt, end_dt)
+    else:
+        store, failures = run_threaded_engine(es_url, auth, filter_pattern, start_dt, end_dt)
+
+    series = None
+    if peak_hour:
+        set_phase("peak hour")
+        measured = sum(1 for row in store.rows() if store.get(row, "ts_field"))
+        print(f"\n[+] Searching hourly buckets for {measured} target(s)...")
+        series, peak_failed = measure_peak_hours(es_url, auth, store, start_dt, end_dt)
+        if peak_failed:
+            print(f"      Hourly search failed for {len(peak_failed)} target(s); "
+                  f"peak hour excludes them.")
+
+    if DOC_SIZE_SAMPLING:
+        set_phase("doc size sampling")
+        print(f"\n[+] Sampling document sizes for {len(store)} target(s)...")
+        sample_failed = sample_doc_sizes(es_url, auth, store, start_dt, end_dt)
+        if sample_failed:
+            print(f"      No sample for {len(sample_failed)} target(s).")
+
+    if deferred and _result_sinks is not None:
+        _result_sinks.write_store(store, failures)
+
+    return store, failures, series
+
+def run_fleet(clusters, start_dt, end_dt, engine="threads", peak_hour=False):
+    """
+    Analyze every cluster concurrently, one thread per cluster, under a
+    RequestBudget of FLEET_MAX_IN_FLIGHT requests overall and each cluster's
+    max_in_flight. Results and failures are tagged with their cluster.
+    Returns {cluster name: (ResultStore, failures, hourly series)}.
     """
-    session = requests.Session()
-    session.auth = auth
-    session.verify = False
+    budget = RequestBudget(FLEET_MAX_IN_FLIGHT)
+    for cluster in clusters:
+        budget.add_cluster(cluster["url"], cluster["max_in_flight"])
+    set_request_budget(budget)
 
+    output = PrefixedOutput(sys.stdout)
+    sys.stdout = output
+
+    def run_one(cluster):
+        output.set_prefix(f"[{cluster['name']}] ")
+        try:
+            return analyze_cluster(
+                cluster["url"], cluster["auth"], cluster["pattern"], start_dt, end_dt,
+                engine, peak_hour, cluster["name"],
+            )
+        except Exception as e:
+            # One unreachable cluster must not sink the fleet report
+            print(f"Cluster analysis failed: {e}")
+            res = failure(cluster["name"], "cluster", str(e))
+            if _result_sinks is not None:
+                _result_sinks.write(res)
+            return ResultStore(), [res], None
+        finally:
+            # Stop this cluster's phase clock; "report" is left out of the timing
+            set_phase("report")
+            output.clear_prefix()
+
+    outcomes = {}
     try:
-        r_stats = session.get(f"{es_url}/{index_name}/_stats", timeout=30)
-        if r_stats.status_code != 200:
-            return None
+        with ThreadPoolExecutor(max_workers=len(clusters)) as executor:
+            for cluster, outcome in zip(clusters, executor.map(run_one, clusters)):
+                store, failures, _ = outcome
+                for row in store.rows():
+                    store.set(row, "cluster", cluster["name"])
+                for res in failures:
+                    res["cluster"] = cluster["name"]
+                outcomes[cluster["name"]] = outcome
+    finally:
+        sys.stdout = output._stream
+        set_request_budget(None)
+    return outcomes
+
+# ================= RESULT SINKS =================
+SINK_FIELDS = (
+    "cluster", "name", "type", "range_docs", "est_size_gb", "ingest_rate_gb",
+    "ts_field", "note", "error",
+    "peak_hour_gb", "p99_hour_gb", "peak_hour",
+    "sample_docs", "sampled_doc_bytes", "sampled_size_gb", "sampled_size_ci_gb",
+    "daily_docs", "daily_gb",
+)
 
-        primaries = r_stats.json()["_all"]["primaries"]
-        total_bytes_primary = primaries["docs"].get("total_size_in_bytes", 0)
-        total_docs_primary = primaries["docs"].get("count", 0)
+class NdjsonSink:
+    """One JSON object per result and line, flushed as soon as it is written."""
 
-        if total_docs_primary == 0:
-            return None
+    def __init__(self, path):
+        self._file = open(path, "w", encoding="utf-8")
 
-        avg_doc_size_bytes = total_bytes_primary / total_docs_primary
+    def write(self, record):
+        self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._file.flush()
 
-        ts_field = detect_timestamp_field(session, es_url, index_name)
+    def close(self):
+        self._file.close()
 
-        if ts_field:
-            query = {
-                "query": {
-                    "range": {
-                        ts_field: {
-                            "gte": start_dt.isoformat(),
-                            "lte": end_dt.isoformat()
-                        }
-                    }
-                }
-            }
-            note = f"filtered by {ts_field}"
+class CsvSink:
+    """One row per result under a SINK_FIELDS header; daily series are JSON-encoded."""
+
+    def __init__(self, path):
+        self._file = open(path, "w", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(self._file, fieldnames=SINK_FIELDS, extrasaction="ignore")
+        self._writer.writeheader()
+
+    def write(self, record):
+        row = dict(record)
+        for field in ("daily_docs", "daily_gb"):
+            if field in row:
+                row[field] = json.dumps(row[field], separators=(",", ":"))
+        self._writer.writerow(row)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+class ArrowSink:
+    """
+    Columnar sink: Parquet, or Arrow IPC for .arrow/.feather paths.
+    Results are buffered and written as one record batch (a Parquet row
+    group) every SINK_BATCH_SIZE rows, so memory stays bounded on huge runs.
+    """
+
+    def __init__(self, path, batch_size=None):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Parquet/Arrow output requires pyarrow: pip install pyarrow")
+
+        self._pa = pa
+        self.schema = pa.schema([
+            ("cluster", pa.string()),
+            ("name", pa.string()),
+            ("type", pa.string()),
+            ("range_docs", pa.int64()),
+            ("est_size_gb", pa.float64()),
+            ("ingest_rate_gb", pa.float64()),
+            ("ts_field", pa.string()),
+            ("note", pa.string()),
+            ("error", pa.string()),
+            ("peak_hour_gb", pa.float64()),
+            ("p99_hour_gb", pa.float64()),
+            ("peak_hour", pa.string()),
+            ("sample_docs", pa.int64()),
+            ("sampled_doc_bytes", pa.float64()),
+            ("sampled_size_gb", pa.float64()),
+            ("sampled_size_ci_gb", pa.float64()),
+            ("daily_docs", pa.map_(pa.string(), pa.int64())),
+            ("daily_gb", pa.map_(pa.string(), pa.float64())),
+        ])
+        if path.endswith((".arrow", ".feather")):
+            self._writer = pa.ipc.new_file(path, self.schema)
         else:
-            query = {"query": {"match_all": {}}}
-            note = "no timestamp field, counted all docs"
+            self._writer = pq.ParquetWriter(path, self.schema)
+        self._batch_size = batch_size or SINK_BATCH_SIZE
+        self._pending = []
 
-        r_count = session.post(f"{es_url}/{index_name}/_count", json=query, timeout=30)
-        if r_count.status_code != 200:
-            return None
+    def write(self, record):
+        self._pending.append(record)
+        if len(self._pending) >= self._batch_size:
+            self._write_batch()
 
-        range_doc_count = r_count.json().get("count", 0)
-        if range_doc_count == 0:
-            return None
+    def _write_batch(self):
+        if not self._pending:
+            return
+        rows = []
+        for record in self._pending:
+            row = dict(record)
+            for field in ("daily_docs", "daily_gb"):
+                if field in row:
+                    row[field] = list(row[field].items())
+            rows.append(row)
+        self._writer.write_batch(self._pa.RecordBatch.from_pylist(rows, schema=self.schema))
+        self._pending = []
 
-        est_range_size_gb = (range_doc_count * avg_doc_size_bytes) / (1024 ** 3)
-        delta = end_dt - start_dt
-        days_diff = max(delta.days + (delta.seconds / 86400), 1)
-        ingest_per_day_gb = est_range_size_gb / days_diff
+    def close(self):
+        self._write_batch()
+        self._writer.close()
 
-        return {
-            "name": index_name,
-            "type": "regular",
-            "range_docs": range_doc_count,
-            "est_size_gb": est_range_size_gb,
-            "ingest_rate_gb": ingest_per_day_gb,
-            "ts_field": ts_field,
-            "note": note,
-        }
+class ResultSinks:
+    """
+    Fans finished results out to the --ndjson/--csv/--parquet sinks.
+    collect() passes every result through emit() as soon as it is filed, so
+    NDJSON and CSV rows appear while the run is still going. A thread bound
+    with deferred=True (peak hour or sampling will still add fields) writes
+    its rows through write_store() once those passes are done instead.
+    Records are tagged with the cluster bound to the writing thread.
+    """
 
-    except Exception:
-        return None
+    def __init__(self, sinks):
+        self.sinks = sinks
+        self.written = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def bind(self, cluster=None, deferred=False):
+        self._local.cluster = cluster
+        self._local.deferred = deferred
+
+    def write(self, res):
+        cluster = getattr(self._local, "cluster", None)
+        record = {"cluster": cluster} if cluster is not None else {}
+        record.update(res)
+        with self._lock:
+            for sink in self.sinks:
+                sink.write(record)
+            self.written += 1
+
+    def emit(self, res):
+        if not getattr(self._local, "deferred", False):
+            self.write(res)
+
+    def write_store(self, store, failures):
+        for row in store.rows():
+            self.write(store.row(row))
+        for res in failures:
+            self.write(res)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+_result_sinks = None
+
+def set_result_sinks(sinks):
+    """Install the ResultSinks that collect() writes to (None to disable)."""
+    global _result_sinks
+    _result_sinks = sinks
+
+def emit_result(res):
+    if _result_sinks is not None:
+        _result_sinks.emit(res)
+
+def open_result_sinks(args):
+    """Open the sinks requested on the command line; returns a ResultSinks or None."""
+    sinks = []
+    try:
+        # pyarrow first, so a missing dependency fails before any file is created
+        if args.parquet:
+            sinks.append(ArrowSink(args.parquet))
+        if args.ndjson:
+            sinks.append(NdjsonSink(args.ndjson))
+        if args.csv:
+            sinks.append(CsvSink(args.csv))
+    except OSError:
+        for sink in sinks:
+            sink.close()
+        raise
+    return ResultSinks(sinks) if sinks else None
+
+def close_result_sinks():
+    """Flush and close the installed sinks; returns the number of records written."""
+    sinks = _result_sinks
+    set_result_sinks(None)
+    if sinks is None:
+        return 0
+    sinks.close()
+    return sinks.written
 
 # ================= OUTPUT =================
-def print_table(results, title, col_name_width=55):
+def print_table(store, rows, title, col_name_width=55):
+    """Print the given ResultStore rows as a table; returns their summed ingest rate."""
     col_docs = 15
     col_size = 18
     col_rate = 18
-    total_width = col_name_width + col_docs + col_size + col_rate
+    col_sample = 26 if any(store.get(row, "sampled_size_gb") is not None for row in rows) else 0
+    total_width = col_name_width + col_docs + col_size + col_sample + col_rate
 
     header = (
         f"{'Name':<{col_name_width}}"
         f"{'Range Docs':>{col_docs}}"
         f"{'Est. Prim. Size':>{col_size}}"
-        f"{'Ingest/Day':>{col_rate}}"
+        + (f"{'Sampled Size (95% CI)':>{col_sample}}" if col_sample else "")
+        + f"{'Ingest/Day':>{col_rate}}"
     )
     line = "-" * total_width
 
@@ -259,36 +4015,337 @@ def print_table(results, title, col_name_width=55):
     print(header)
     print(line)
 
-    total_daily = 0.0
-    for r in results:
-        total_daily += r["ingest_rate_gb"]
+    names = store.columns["name"]
+    range_docs = store.columns["range_docs"]
+    est_size = store.columns["est_size_gb"]
+    ingest_rate = store.columns["ingest_rate_gb"]
+    for row in rows:
+        sampled = ""
+        if col_sample:
+            sampled = "-"
+            if store.get(row, "sampled_size_gb") is not None:
+                sampled = (f"{format_size(store.get(row, 'sampled_size_gb'))} "
+                           f"± {format_size(store.get(row, 'sampled_size_ci_gb'))}")
         print(
-            f"{r['name']:<{col_name_width}}"
-            f"{r['range_docs']:>{col_docs},}"
-            f"{format_size(r['est_size_gb']):>{col_size}}"
-            f"{format_size(r['ingest_rate_gb']):>{col_rate}}"
+            f"{store.strings[names[row]]:<{col_name_width}}"
+            f"{range_docs[row]:>{col_docs},}"
+            f"{format_size(est_size[row]):>{col_size}}"
+            + (f"{sampled:>{col_sample}}" if col_sample else "")
+            + f"{format_size(ingest_rate[row]):>{col_rate}}"
         )
 
     print(line)
-    return total_daily
+    return sum(map(ingest_rate.__getitem__, rows))
+
+def print_daily_profile(store, col_name_width=40):
+    """
+    Print min / mean / p95 / max GB per day and the peak day of every row
+    with a daily series, followed by the same profile for their per-day sum.
+    """
+    rows = [row for row in store.order() if store.get(row, "daily_gb")]
+    if not rows:
+        return
+
+    col = 12
+    header = (
+        f"  {'Name':<{col_name_width}}"
+        f"{'Min/Day':>{col}}{'Mean/Day':>{col}}{'P95/Day':>{col}}{'Max/Day':>{col}}"
+        f"{'Peak Day':>{col}}"
+    )
+    print(header)
+    print(f"  {'-' * (col_name_width + col * 5)}")
+
+    def print_row(name, profile):
+        print(
+            f"  {name[:col_name_width]:<{col_name_width}}"
+            f"{format_size(profile['min_gb']):>{col}}"
+            f"{format_size(profile['mean_gb']):>{col}}"
+            f"{format_size(profile['p95_gb']):>{col}}"
+            f"{format_size(profile['max_gb']):>{col}}"
+            f"{profile['peak_day']:>{col}}"
+        )
+
+    overall = {}
+    for row in rows:
+        daily_gb = store.get(row, "daily_gb")
+        print_row(store.label(row), daily_profile(daily_gb))
+        for day, gb in daily_gb.items():
+            overall[day] = overall.get(day, 0.0) + gb
+    print(f"  {'-' * (col_name_width + col * 5)}")
+    print_row("Overall", daily_profile(overall))
+    if len(rows) < len(store):
+        print(f"  ({len(store) - len(rows)} target(s) without a timestamp field not included)")
+
+def result_label(r):
+    """Display name of a failure entry: prefixed with its cluster in a fleet report."""
+    if "cluster" in r:
+        return f"{r['cluster']}/{r['name']}"
+    return r["name"]
+
+def type_label(kind):
+    if kind == "data_stream":
+        return "DS "
+    return "CLU" if kind == "cluster" else "IDX"
+
+def print_results(store):
+    """Print the data stream and regular index tables; returns both daily subtotals."""
+    total_ds_daily = 0.0
+    total_reg_daily = 0.0
+
+    ds_count = store.count("data_stream")
+    if ds_count:
+        total_ds_daily = print_table(
+            store,
+            store.order(kind="data_stream"),
+            f"[ DATA STREAMS ] — {ds_count} active",
+            col_name_width=55
+        )
+        print(f"  Subtotal Data Streams /day   : {format_size(total_ds_daily)}")
+
+    reg_count = store.count("regular")
+    if reg_count:
+        total_reg_daily = print_table(
+            store,
+            store.order(kind="regular"),
+            f"\n[ REGULAR INDICES ] — {reg_count} active",
+            col_name_width=55
+        )
+        print(f"  Subtotal Regular Indices /day: {format_size(total_reg_daily)}")
+
+    return total_ds_daily, total_reg_daily
+
+def print_totals(total_ds_daily, total_reg_daily, peak=None):
+    grand_total = total_ds_daily + total_reg_daily
+    print(f"  Data Streams          : {format_size(total_ds_daily)}/day")
+    print(f"  Regular Indices       : {format_size(total_reg_daily)}/day")
+    print(f"  {'─'*42}")
+    print(f"  Total per Day         : {format_size(grand_total)}")
+    print(f"  Total per Month (~30d): {format_size(grand_total * 30)}")
+    if peak:
+        print(f"  Peak Hour             : {format_size(peak['peak_hour_gb'])}/hour "
+              f"({peak['peak_hour']} UTC)")
+        print(f"  P99 Hour              : {format_size(peak['p99_hour_gb'])}/hour")
+
+def print_rankings(store, peak=None):
+    """Top 10 by ingest rate, top 10 by peak hour and the daily profile."""
+    print(f"\n  Top 10 Highest Ingest Rate:")
+    for i, row in enumerate(store.top(10), 1):
+        print(f"  {i:>2}. [{type_label(store.get(row, 'type'))}] {store.label(row)[:58]:<58} "
+              f"{format_size(store.get(row, 'ingest_rate_gb'))}/day")
+
+    if peak:
+        print(f"\n  Top 10 Peak Hour (UTC):")
+        for i, row in enumerate(store.top_extra(10, "peak_hour_gb"), 1):
+            print(f"  {i:>2}. [{type_label(store.get(row, 'type'))}] {store.label(row)[:40]:<40} "
+                  f"peak {format_size(store.get(row, 'peak_hour_gb')):>10}/hour "
+                  f"at {store.get(row, 'peak_hour')}, "
+                  f"p99 {format_size(store.get(row, 'p99_hour_gb'))}/hour")
+
+    if DAILY_SERIES and any("daily_gb" in extra for extra in store.extras.values()):
+        print_section(f"DAILY INGEST PROFILE ({DAILY_TIME_ZONE})")
+        print_daily_profile(store)
+
+def print_failures(failures):
+    # Failed targets are listed instead of silently dropped
+    if failures:
+        print_section(f"FAILED — {len(failures)} NOT INCLUDED IN TOTALS")
+        for r in failures:
+            print(f"  [{type_label(r['type'])}] {result_label(r)[:58]:<58} {r['error']}")
+
+def print_http_stats(es_urls, engine="threads"):
+    print_section("HTTP CONNECTIONS")
+
+    # Connection reuse (shared session of the threaded engine)
+    conn = connection_stats()
+    if conn["requests"]:
+        print(f"  Requests sent         : {conn['requests']:,}")
+        print(f"  Handshakes (new conn) : {conn['handshakes']:,}")
+        print(f"  Reused connections    : {conn['reused']:,}")
+
+    for name, es_url in es_urls.items():
+        policy = get_retry_policy(es_url)
+        single = len(es_urls) == 1
+        label = "Retries used" if single else f"Retries {name}"[:21]
+        print(f"  {label:<22}: {policy.retries_used:,} of {policy.budget:,}")
+        if policy.breaker_trips:
+            label = "Circuit breaker trips" if single else f"Breaker trips {name}"[:21]
+            print(f"  {label:<22}: {policy.breaker_trips}")
+
+    if ADAPTIVE_CONCURRENCY and engine == "threads":
+        for name, es_url in es_urls.items():
+            controller = get_controller(es_url)
+            label = "Concurrency (AIMD)" if len(es_urls) == 1 else f"AIMD {name}"[:21]
+            print(f"  {label:<22}: final {controller.limit}, peak {controller.peak}, "
+                  f"+{controller.increases}/-{controller.decreases} adjustments")
+
+    if DEBUG_WIRE_STATS:
+        print_section("WIRE BYTES PER PHASE")
+        print(f"  {'Phase':<28}{'Requests':>10}{'Sent':>12}{'Received':>12}{'Decoded':>12}")
+        for name, es_url in es_urls.items():
+            if len(es_urls) > 1:
+                print(f"  [{name}]")
+            for phase, c in wire_stats(es_url).items():
+                print(
+                    f"  {phase:<28}{c['requests']:>10,}"
+                    f"{format_bytes(c['sent']):>12}"
+                    f"{format_bytes(c['received']):>12}"
+                    f"{format_bytes(c['decoded']):>12}"
+                )
+
+def print_phase_times(es_urls):
+    """Wall time per phase of each cluster run, discovery included."""
+    timings = {}
+    for name, es_url in es_urls.items():
+        times = phase_times(es_url)
+        for phase in ("setup", "report"):
+            times.pop(phase, None)
+        if times:
+            timings[name] = times
+    if not timings:
+        return
+    print_section("PHASE TIMING")
+    for name, times in timings.items():
+        if len(es_urls) > 1:
+            print(f"  [{name}]")
+        for phase, seconds in times.items():
+            print(f"  {phase[:28]:<28}: {seconds:8.2f}s")
+        print(f"  {'─'*38}")
+        print(f"  {'Total':<28}: {sum(times.values()):8.2f}s")
+
+def print_fleet_report(outcomes, start_dt, end_dt, start_str, end_str):
+    """Per-cluster tables, then the fleet-wide grand total, rankings and failures."""
+    cluster_totals = {}
+    fleet, failures, fleet_series = ResultStore(), [], {}
+    for name, (store, cluster_failures, series) in outcomes.items():
+        print_section(f"CLUSTER {name}: {start_str} to {end_str}")
+        ds_total, reg_total = print_results(store)
+        print(f"  Cluster Total /day           : {format_size(ds_total + reg_total)}")
+        cluster_totals[name] = (ds_total, reg_total)
+        fleet.extend(store)
+        failures += cluster_failures
+        for hour, gb in (series or {}).items():
+            fleet_series[hour] = fleet_series.get(hour, 0.0) + gb
+
+    print_section(f"FLEET GRAND TOTAL — {len(outcomes)} CLUSTERS (PRIMARY SHARDS ONLY)")
+    for name, (ds_total, reg_total) in cluster_totals.items():
+        print(f"  {name[:22]:<22}: {format_size(ds_total + reg_total)}/day")
+    print(f"  {'─'*42}")
+    peak = hourly_profile(fleet_series, start_dt, end_dt)
+    print_totals(
+        sum(t[0] for t in cluster_totals.values()),
+        sum(t[1] for t in cluster_totals.values()),
+        peak,
+    )
+    print_rankings(fleet, peak)
+    print_failures(sorted(failures, key=result_label))
 
 # ================= MAIN =================
-def main():
-    print("=== Elasticsearch Unified Ingest Analyzer ===")
-    print("(Data Streams + Regular Indices | Primary Shards Only)\n")
+def positive_int(value):
+    """argparse type for --workers."""
+    n = int(value)
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {n}")
+    return n
 
-    es_url = input("Elasticsearch URL (e.g. https://localhost:9200): ").strip().rstrip("/")
-    username = input("Username: ").strip()
-    password = getpass.getpass("Password: ")
+def build_arg_parser():
+    parser = argparse.ArgumentParser(
+        description="Estimate daily ingest for Elasticsearch data streams and regular indices. "
+                    "Options left out are prompted for when running in a terminal.",
+        epilog=f"Exit codes: {EXIT_OK} success, {EXIT_ERROR} error, 2 usage error, "
+               f"{EXIT_PARTIAL} report written but some targets failed.",
+    )
+    parser.add_argument(
+        "--url",
+        help="Elasticsearch URL, e.g. https://localhost:9200",
+    )
+    parser.add_argument(
+        "--user",
+        help="Elasticsearch username",
+    )
+    parser.add_argument(
+        "--password-env",
+        metavar="VAR",
+        default=PASSWORD_ENV,
+        help=f"environment variable holding the password (default {PASSWORD_ENV})",
+    )
+    parser.add_argument(
+        "--password-file",
+        metavar="FILE",
+        help="read the password from the first line of FILE instead",
+    )
+    parser.add_argument(
+        "--pattern",
+        help="wildcard filter for regular indices, e.g. 'app-logs-*' (default: all)",
+    )
+    parser.add_argument(
+        "--start",
+        metavar="YYYY-MM-DD",
+        help="first day of the analysis window",
+    )
+    parser.add_argument(
+        "--end",
+        metavar="YYYY-MM-DD",
+        help="last day of the analysis window (inclusive)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=positive_int,
+        help=f"max parallel requests for the threaded engine; adaptive concurrency "
+             f"starts there and only backs off (default {MAX_WORKERS}, "
+             f"adaptive up to {ADAPTIVE_MAX_WORKERS})",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=("threads", "async"),
+        default="threads",
+        help="threads: --workers worker threads (default); "
+             "async: asyncio with up to ASYNC_MAX_IN_FLIGHT requests in flight (needs httpx)",
+    )
+    parser.add_argument(
+        "--peak-hour",
+        action="store_true",
+        help="also search hourly buckets and report peak and p99 GB/hour",
+    )
+    parser.add_argument(
+        "--clusters",
+        metavar="FILE",
+        help="JSON list of cluster definitions to analyze concurrently "
+             "instead of a single --url",
+    )
+    parser.add_argument(
+        "--ndjson",
+        metavar="FILE",
+        help="write one JSON object per result, streamed as results complete",
+    )
+    parser.add_argument(
+        "--csv",
+        metavar="FILE",
+        help="write one CSV row per result",
+    )
+    parser.add_argument(
+        "--parquet",
+        metavar="FILE",
+        help="write results as Parquet (Arrow IPC for .arrow/.feather files), "
+             "in batches of SINK_BATCH_SIZE rows (needs pyarrow)",
+    )
+    return parser
 
-    print("\n--- Regular Index Filter (Optional) ---")
-    print("Example: 'app-logs-*', 'metrics-*', or leave blank for all")
-    filter_pattern = input("Index pattern filter: ").strip() or None
+def start_result_sinks(args):
+    """Open and install the requested result sinks; returns False if a file cannot be created."""
+    try:
+        set_result_sinks(open_result_sinks(args))
+    except OSError as e:
+        print(f"Cannot open output file: {e}")
+        return False
+    return True
 
-    print("\n--- Analysis Time Range ---")
-    start_str = input("Start Date (YYYY-MM-DD): ").strip()
-    end_str = input("End Date (YYYY-MM-DD): ").strip()
+def finish_result_sinks():
+    written = close_result_sinks()
+    if written:
+        print(f"\n[+] {written} result record(s) written to the output file(s).")
 
+def parse_window(start_str, end_str):
+    """Turn YYYY-MM-DD dates into (start_str, end_str, start_dt, end_dt); None if invalid."""
     try:
         start_dt = datetime.strptime(start_str, "%Y-%m-%d").replace(tzinfo=timezone.utc)
         end_dt = (
@@ -296,105 +4353,159 @@ def main():
             + timedelta(days=1, seconds=-1)
         )
     except ValueError:
+        return None
+    return start_str, end_str, start_dt, end_dt
+
+def prompt_window(start_str=None, end_str=None):
+    """Prompt for the dates not given; returns (start_str, end_str, start_dt, end_dt) or None."""
+    print("\n--- Analysis Time Range ---")
+    if start_str is None:
+        start_str = input("Start Date (YYYY-MM-DD): ").strip()
+    if end_str is None:
+        end_str = input("End Date (YYYY-MM-DD): ").strip()
+
+    window = parse_window(start_str, end_str)
+    if window is None:
         print("Invalid date format! Please use YYYY-MM-DD.")
-        return
+    return window
 
-    auth = HTTPBasicAuth(username, password)
-    requests.packages.urllib3.disable_warnings()
+def resolve_window(args, parser, interactive):
+    """The analysis window from --start/--end, prompting for missing dates in a terminal."""
+    if args.start is not None and args.end is not None:
+        window = parse_window(args.start, args.end)
+        if window is None:
+            parser.error("--start and --end must be dates in YYYY-MM-DD format")
+        return window
+    if not interactive:
+        parser.error("--start and --end are required when not running in a terminal")
+    return prompt_window(args.start, args.end)
+
+def resolve_password(args, interactive):
+    """
+    The password from --password-file, else the --password-env variable,
+    else a hidden prompt in a terminal. None if there is no source.
+    Raises OSError if the password file cannot be read.
+    """
+    if args.password_file:
+        with open(args.password_file) as f:
+            return f.readline().rstrip("\r\n")
+    password = os.environ.get(args.password_env)
+    if password is not None:
+        return password
+    if interactive:
+        return getpass.getpass("Password: ")
+    return None
+
+def exit_status(stores, failures):
+    """EXIT_OK, EXIT_PARTIAL if anything failed, EXIT_ERROR if nothing but failures."""
+    if not failures:
+        return EXIT_OK
+    if not any(len(store) for store in stores):
+        return EXIT_ERROR
+    return EXIT_PARTIAL
 
-    # ---- Step 1: Fetch Data Streams ----
-    print("\n[1/4] Fetching data streams...")
+def run_fleet_command(args, parser, interactive):
     try:
-        data_stream_names = get_data_streams(es_url, auth)
-        print(f"      Found {len(data_stream_names)} data stream(s).")
-    except Exception as e:
-        print(f"      Failed to fetch data streams: {e}")
-        data_stream_names = set()
+        clusters = load_clusters(args.clusters)
+    except (OSError, ValueError) as e:
+        print(f"Invalid cluster definitions: {e}")
+        return EXIT_ERROR
+    print(f"Clusters: {', '.join(c['name'] for c in clusters)}")
+    window = resolve_window(args, parser, interactive)
+    if window is None:
+        return EXIT_ERROR
+    start_str, end_str, start_dt, end_dt = window
+    requests.packages.urllib3.disable_warnings()
 
-    # ---- Step 2: Fetch Regular Indices ----
-    print("[2/4] Fetching regular indices...")
+    if not start_result_sinks(args):
+        return EXIT_ERROR
     try:
-        regular_indices = get_regular_indices(es_url, auth, data_stream_names, filter_pattern)
-        print(f"      Found {len(regular_indices)} regular index/indices.")
-    except Exception as e:
-        print(f"      Failed to fetch regular indices: {e}")
-        regular_indices = []
+        outcomes = run_fleet(clusters, start_dt, end_dt, args.engine, args.peak_hour)
+    finally:
+        finish_result_sinks()
+    print_fleet_report(outcomes, start_dt, end_dt, start_str, end_str)
+    print_http_stats({c["name"]: c["url"] for c in clusters}, args.engine)
+    print_phase_times({c["name"]: c["url"] for c in clusters})
+    return exit_status(
+        [store for store, _, _ in outcomes.values()],
+        [res for _, failures, _ in outcomes.values() for res in failures],
+    )
 
-    # ---- Step 3: Analyze Data Streams ----
-    ds_results = []
-    if data_stream_names:
-        print(f"\n[3/4] Analyzing {len(data_stream_names)} data stream(s)...")
-        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            futures = {
-                executor.submit(process_data_stream, es_url, auth, ds, start_dt, end_dt): ds
-                for ds in data_stream_names
-            }
-            for future in as_completed(futures):
-                res = future.result()
-                if res:
-                    ds_results.append(res)
-                    print(f"  [DS]  {res['name']}")
-        ds_results.sort(key=lambda x: x["ingest_rate_gb"], reverse=True)
-    else:
-        print("\n[3/4] No data streams found, skipping.")
+def run_cluster_command(args, parser, interactive):
+    es_url, username, filter_pattern = args.url, args.user, args.pattern
+    if es_url is None or username is None:
+        if not interactive:
+            parser.error("--url and --user (or --clusters) are required "
+                         "when not running in a terminal")
+        if es_url is None:
+            es_url = input("Elasticsearch URL (e.g. https://localhost:9200): ")
+        if username is None:
+            username = input("Username: ").strip()
+    es_url = es_url.strip().rstrip("/")
 
-    # ---- Step 4: Analyze Regular Indices ----
-    reg_results = []
-    if regular_indices:
-        print(f"\n[4/4] Analyzing {len(regular_indices)} regular index/indices...")
-        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            futures = {
-                executor.submit(process_regular_index, es_url, auth, idx, start_dt, end_dt): idx
-                for idx in regular_indices
-            }
-            for future in as_completed(futures):
-                res = future.result()
-                if res:
-                    reg_results.append(res)
-                    ts_info = res.get("ts_field") or "no-timestamp"
-                    print(f"  [IDX] {res['name']} ({ts_info})")
-        reg_results.sort(key=lambda x: x["ingest_rate_gb"], reverse=True)
-    else:
-        print("\n[4/4] No regular indices found, skipping.")
+    try:
+        password = resolve_password(args, interactive)
+    except OSError as e:
+        print(f"Cannot read password file: {e}")
+        return EXIT_ERROR
+    if password is None:
+        parser.error(f"no password: set {args.password_env} or use --password-file")
 
-    # ---- Output ----
-    print_section(f"ANALYSIS RESULTS: {start_str} to {end_str}")
+    if filter_pattern is None and interactive and args.url is None:
+        print("\n--- Regular Index Filter (Optional) ---")
+        print("Example: 'app-logs-*', 'metrics-*', or leave blank for all")
+        filter_pattern = input("Index pattern filter: ")
+    filter_pattern = (filter_pattern or "").strip() or None
 
-    total_ds_daily = 0.0
-    total_reg_daily = 0.0
+    window = resolve_window(args, parser, interactive)
+    if window is None:
+        return EXIT_ERROR
+    start_str, end_str, start_dt, end_dt = window
 
-    if ds_results:
-        total_ds_daily = print_table(
-            ds_results,
-            f"[ DATA STREAMS ] — {len(ds_results)} active",
-            col_name_width=55
-        )
-        print(f"  Subtotal Data Streams /day   : {format_size(total_ds_daily)}")
+    auth = HTTPBasicAuth(username, password)
+    requests.packages.urllib3.disable_warnings()
 
-    if reg_results:
-        total_reg_daily = print_table(
-            reg_results,
-            f"\n[ REGULAR INDICES ] — {len(reg_results)} active",
-            col_name_width=55
+    if not start_result_sinks(args):
+        return EXIT_ERROR
+    try:
+        store, failures, series = analyze_cluster(
+            es_url, auth, filter_pattern, start_dt, end_dt, args.engine, args.peak_hour
         )
-        print(f"  Subtotal Regular Indices /day: {format_size(total_reg_daily)}")
+    finally:
+        finish_result_sinks()
+    set_phase("report")
+    peak = hourly_profile(series, start_dt, end_dt) if series else None
+
+    # ---- Output ----
+    print_section(f"ANALYSIS RESULTS: {start_str} to {end_str}")
+    total_ds_daily, total_reg_daily = print_results(store)
 
     # Grand Total
-    grand_total = total_ds_daily + total_reg_daily
     print_section("GRAND TOTAL (PRIMARY SHARDS ONLY)")
-    print(f"  Data Streams          : {format_size(total_ds_daily)}/day")
-    print(f"  Regular Indices       : {format_size(total_reg_daily)}/day")
-    print(f"  {'─'*42}")
-    print(f"  Total per Day         : {format_size(grand_total)}")
-    print(f"  Total per Month (~30d): {format_size(grand_total * 30)}")
+    print_totals(total_ds_daily, total_reg_daily, peak)
+    print_rankings(store, peak)
+    print_failures(failures)
+    print_http_stats({es_url: es_url}, args.engine)
+    print_phase_times({es_url: es_url})
+    return exit_status([store], failures)
 
-    # Top 10 overall
-    all_results = ds_results + reg_results
-    all_results.sort(key=lambda x: x["ingest_rate_gb"], reverse=True)
-    print(f"\n  Top 10 Highest Ingest Rate:")
-    for i, r in enumerate(all_results[:10], 1):
-        label = "DS " if r["type"] == "data_stream" else "IDX"
-        print(f"  {i:>2}. [{label}] {r['name'][:58]:<58} {format_size(r['ingest_rate_gb'])}/day")
+def main(argv=None):
+    """Run the analyzer from command line flags; returns the process exit code."""
+    parser = build_arg_parser()
+    args = parser.parse_args(argv)
+    interactive = sys.stdin.isatty()
+    if args.workers is not None:
+        set_max_workers(args.workers)
+
+    print("=== Elasticsearch Unified Ingest Analyzer ===")
+    print("(Data Streams + Regular Indices | Primary Shards Only)\n")
+    ignored = async_ignored_settings() if args.engine == "async" else []
+    if ignored:
+        print(f"Note: --engine async ignores {', '.join(ignored)} (threaded engine only).\n")
+
+    if args.clusters:
+        return run_fleet_command(args, parser, interactive)
+    return run_cluster_command(args, parser, interactive)
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())